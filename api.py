@@ -0,0 +1,193 @@
+from functools import wraps
+import hashlib
+import json
+
+from flask import Module, Response, abort, request
+from sqlalchemy.orm.exc import NoResultFound
+
+from functions import calculate_mean, calculate_percentiles
+from models import Leaderboard, OfficialScores, Solution, SolutionRank, Version, level_registry
+
+
+# read-only JSON versions of the leaderboard, level and solution data, for
+# sites and tools that track SolutionNet
+# every response carries an ETag, so pollers get an empty 304 if nothing changed
+api = Module(__name__, url_prefix='/api')
+
+API_PAGE_SIZE = 100
+
+
+def json_response(data):
+    return Response(json.dumps(data), mimetype='application/json')
+
+
+def conditional(response):
+    """Tags a response with a hash of its body, for the views that can't
+    tell whether their data changed without reading it."""
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def versioned(version):
+    """Decorates a view so that its ETag comes from the URL and version,
+    which is called with the view's arguments and returns the version of
+    the data the response is built from. A poll for data that hasn't
+    changed gets its 304 without running the view or any query."""
+    def decorator(view):
+        @wraps(view)
+        def versioned_view(**kwargs):
+            tag = request.path + '?' + request.query_string + ' ' + version(**kwargs)
+            etag = hashlib.sha1(tag).hexdigest()
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                response = view(**kwargs)
+            response.set_etag(etag)
+            return response
+        return versioned_view
+    return decorator
+
+
+def level_version(level_slug, **kwargs):
+    # bumped in the database when the level's ranks or official scores
+    # change, so every process sees it
+    return str(Version.get('level:' + level_slug))
+
+
+def level_data(level):
+    return {'level_id': level.level_id,
+            'slug': level.slug,
+            'name': level.name,
+            'number': level.number,
+            'category': level.category,
+            'outside_view': bool(level.outside_view),
+            'reactor_options': level.reactor_option_list}
+
+
+def solution_data(solution):
+    return {'solution_id': solution.solution_id,
+            'level': solution.level.slug,
+            'user': solution.user.username,
+            'cycles': solution.cycle_count,
+            'symbols': solution.symbol_count,
+            'reactors': solution.reactor_count,
+            'uploaded': solution.upload_time.isoformat(),
+            'description': solution.description,
+            'youtube': solution.youtube}
+
+
+def histogram_data(counts):
+    return {'start': counts[0],
+            'end': counts[1],
+            'step': counts[2],
+            'counts': counts[6:]}
+
+
+def get_level(slug):
+    level = level_registry.current().by_slug.get(slug)
+    if level is None:
+        abort(404)
+    return level
+
+
+@api.route('/levels')
+@versioned(lambda: str(level_registry.current().version))
+def levels():
+    levels = level_registry.current().levels
+    return json_response({'levels': [level_data(level) for level in levels]})
+
+
+@api.route('/leaderboards/<level_slug>/<leaderboard_slug>', defaults={'reactors': 0})
+@api.route('/leaderboards/<level_slug>/<leaderboard_slug>/<int:reactors>')
+@versioned(level_version)
+def leaderboard(level_slug, leaderboard_slug, reactors):
+    level = get_level(level_slug)
+    try:
+        leaderboard = Leaderboard.query.filter_by(slug=leaderboard_slug).one()
+    except NoResultFound:
+        abort(404)
+
+    after = request.args.get('after', 0, type=int)
+    solution_ranks = SolutionRank.page(leaderboard.leaderboard_id, level.level_id, reactors, after,
+                                       API_PAGE_SIZE + 1).all()
+
+    next_after = None
+    if len(solution_ranks) > API_PAGE_SIZE:
+        solution_ranks = solution_ranks[:API_PAGE_SIZE]
+        next_after = solution_ranks[-1].rank
+
+    ranks = []
+    for solution_rank in solution_ranks:
+        solution = solution_rank.solution
+        ranks.append({'rank': solution_rank.rank,
+                      'solution_id': solution.solution_id,
+                      'user': solution.user.username,
+                      'cycles': solution.cycle_count,
+                      'symbols': solution.symbol_count,
+                      'reactors': solution.reactor_count,
+                      'uploaded': solution.upload_time.isoformat()})
+
+    return json_response({'level': level.slug,
+                          'leaderboard': leaderboard.slug,
+                          'reactors': reactors,
+                          'ranks': ranks,
+                          'next_after': next_after})
+
+
+@api.route('/solutions/<int:solution_id>')
+def solution(solution_id):
+    try:
+        solution = Solution.with_details(solution_id).filter(Solution.approved == True).one()
+    except NoResultFound:
+        abort(404)
+
+    data = solution_data(solution)
+    data['ranks'] = [{'leaderboard': solution_rank.leaderboard.slug,
+                      'reactors': solution_rank.reactors,
+                      'rank': solution_rank.rank}
+                     for solution_rank in solution.ranks]
+    # the level, and so the version, isn't known until the solution is read
+    return conditional(json_response(data))
+
+
+@api.route('/official-stats/<level_slug>')
+@versioned(level_version)
+def official_stats(level_slug):
+    level = get_level(level_slug)
+    latest = OfficialScores.latest([level.level_id])
+    if level.level_id not in latest:
+        abort(404)
+
+    scores, (reactors, symbols, cycles), fetches = latest[level.level_id]
+    return json_response({'level': level.slug,
+                          'fetch_date': scores.fetch_date.isoformat(),
+                          'cycles': histogram_data(cycles),
+                          'symbols': histogram_data(symbols),
+                          'reactors': histogram_data(reactors)})
+
+
+def trend_data(counts):
+    start, step = counts[0], counts[2]
+    counts = counts[6:]
+    total = sum(counts)
+    return {'total': total,
+            'mean': calculate_mean(counts, start, step) if total else None,
+            'percentiles': calculate_percentiles(counts, start, step)}
+
+
+@api.route('/official-stats/<level_slug>/trend')
+@versioned(level_version)
+def official_stats_trend(level_slug):
+    """How the official solutions for a level have changed over time, one
+    point for each fetch that changed them."""
+    level = get_level(level_slug)
+    points = []
+    for scores, (reactors, symbols, cycles) in OfficialScores.history(level.level_id):
+        points.append({'fetch_date': scores.fetch_date.isoformat(),
+                       'cycles': trend_data(cycles),
+                       'symbols': trend_data(symbols),
+                       'reactors': trend_data(reactors)})
+    if not points:
+        abort(404)
+
+    return json_response({'level': level.slug, 'trend': points})
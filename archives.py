@@ -0,0 +1,99 @@
+from contextlib import contextmanager
+import gzip
+import os
+import sqlite3
+import tempfile
+import zipfile
+import zlib
+
+
+# saves are copied out of archives this much at a time
+CHUNK_SIZE = 64 * 1024
+
+# the largest decompressed save accepted, real saves are a few megabytes
+MAX_SAVE_SIZE = 64 * 1024 * 1024
+
+
+class BadArchive(Exception):
+    pass
+
+
+class SaveTooLarge(BadArchive):
+    pass
+
+
+def open_save(path):
+    """Returns a file object reading the SpaceChem save at path, decompressing
+    it as it's read if it's a .zip or .gz archive. A zip must hold just the
+    one .user file."""
+    if path.endswith('.zip'):
+        if not zipfile.is_zipfile(path):
+            raise BadArchive
+        zipped = zipfile.ZipFile(path, 'r')
+        try:
+            members = zipped.infolist()
+            if len(members) != 1 or not members[0].filename.endswith('.user'):
+                raise BadArchive
+            return zipped.open(members[0], 'r')
+        finally:
+            # the member that's returned keeps the file open until it's closed
+            zipped.close()
+    elif path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def copy_save(source, destination, max_size=MAX_SAVE_SIZE):
+    """Copies source to destination CHUNK_SIZE bytes at a time, raising
+    SaveTooLarge if there's more than max_size bytes to copy."""
+    copied = 0
+    try:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            copied += len(chunk)
+            if copied > max_size:
+                raise SaveTooLarge
+            destination.write(chunk)
+    except (IOError, EOFError, zipfile.BadZipfile, zlib.error):
+        # corrupt or truncated compressed data
+        raise BadArchive
+    return copied
+
+
+@contextmanager
+def save_database(path, max_size=MAX_SAVE_SIZE):
+    """Opens the save at path as an SQLite connection, closed on leaving the
+    with block.
+
+    Uncompressed saves are opened where they are. SQLite can only open a
+    database from a file, so compressed ones are decompressed into a
+    temporary file, which is removed on leaving the with block or if the
+    save turns out to be too large or corrupt.
+    """
+    temporary = None
+    if not path.endswith(('.zip', '.gz')):
+        if os.path.getsize(path) > max_size:
+            raise SaveTooLarge
+        conn = sqlite3.connect(path)
+    else:
+        source = open_save(path)
+        handle, temporary = tempfile.mkstemp(suffix='.user')
+        try:
+            with os.fdopen(handle, 'wb') as destination:
+                copy_save(source, destination, max_size)
+        except (BadArchive, IOError, zipfile.BadZipfile, zlib.error):
+            os.remove(temporary)
+            raise
+        finally:
+            source.close()
+        conn = sqlite3.connect(temporary)
+
+    try:
+        yield conn
+    finally:
+        conn.close()
+        if temporary:
+            os.remove(temporary)
+
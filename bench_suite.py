@@ -0,0 +1,281 @@
+"""Times the upload, ranking and rendering paths against an in-memory SQLite
+database filled with synthetic data (see savegen.py).
+
+    python bench_suite.py [--output FILE] [--compare FILE] [--sizes N,...]
+                          [--repeats N]
+
+Times SaveFile.process on a generated save (as .user and as .gz),
+SolutionRank.recalculate on levels with each of --sizes solutions, and
+process_solution, process_overview and rendering solution.html for an
+uploaded solution.
+
+Every benchmark runs --repeats times, except that the larger rankings run
+proportionally fewer times. The results are printed, and with --output also
+written as JSON; --compare prints how each result changed from an earlier
+JSON file. Settings other than the database and upload folder come from
+spacechem.cfg as usual.
+"""
+from datetime import datetime, timedelta
+import json
+from optparse import OptionParser
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+# the benchmarks empty the tables they fill, so the database is switched to
+# an in-memory one (through SPACECHEM_SETTINGS) before spacechem is imported
+# and can connect to the configured one
+settings_dir = tempfile.mkdtemp()
+settings_path = os.path.join(settings_dir, 'bench.cfg')
+open(settings_path, 'w').write("SQLALCHEMY_DATABASE_URI = 'sqlite://'\n")
+os.environ['SPACECHEM_SETTINGS'] = settings_path
+
+from flask import render_template
+from flaskext.uploads import configure_uploads
+
+from forms import SolutionForm, savefiles
+from functions import PATH_NAMES, process_overview, process_solution
+from models import (Component, Leaderboard, Level, Member, Pipe, SaveFile, Solution, SolutionRank, User,
+                    UserRank, Version, bulk_insert, db, level_registry, reserve_ids)
+from savegen import level_names, write_save
+from spacechem import app
+
+shutil.rmtree(settings_dir)
+
+
+SIZES = (10, 1000, 100000)
+REPEATS = 5
+
+# the generated save: levels, most reactors per solution, members per
+# reactor and pipes per reactor
+SAVE_LEVELS = 50
+SAVE_REACTORS = 4
+SAVE_MEMBERS = 60
+SAVE_PIPES = 12
+
+# solutions per user on the ranking benchmarks
+SOLUTIONS_PER_USER = 5
+
+
+def timed(function, repeats, setup=None):
+    """Returns the seconds each of repeats calls to function took, calling
+    setup (untimed) before each."""
+    times = []
+    for i in range(repeats):
+        if setup:
+            setup()
+        started = time.time()
+        function()
+        times.append(time.time() - started)
+    return times
+
+
+def result(name, times, **params):
+    return {'name': name,
+            'params': params,
+            'repeats': len(times),
+            'min': min(times),
+            'mean': sum(times) / len(times),
+            'max': max(times)}
+
+
+def result_key(result):
+    return result['name'] + ''.join(' {0}={1}'.format(key, value) for key, value in sorted(result['params'].items()))
+
+
+def check_database():
+    """Stops unless the database is in memory, before anything is deleted."""
+    url = db.engine.url
+    if url.drivername != 'sqlite' or url.database not in (None, '', ':memory:'):
+        sys.exit('bench_suite.py only runs against an in-memory SQLite database, not {0}'.format(url))
+
+
+def setup_database(upload_dir):
+    check_database()
+    app.config['UPLOADS_DEFAULT_DEST'] = upload_dir
+    configure_uploads(app, savefiles)
+    db.create_all()
+    db.session.add(Leaderboard(leaderboard_id=1, slug='cycles', description='Cycles'))
+    db.session.add(Leaderboard(leaderboard_id=2, slug='symbols', description='Symbols'))
+    db.session.add(Leaderboard(leaderboard_id=3, slug='pareto', description='Pareto frontier'))
+    add_levels(level_names(SAVE_LEVELS))
+
+
+def add_levels(names):
+    """Adds levels with an outside view, so solutions are also ranked by
+    reactor count, and returns their ids."""
+    level_ids = reserve_ids(Level.__table__, len(names))
+    bulk_insert(Level.__table__, [{'level_id': level_id,
+                                   'internal_name': name,
+                                   'slug': name,
+                                   'number': '0-0',
+                                   'name': name,
+                                   'order1': 0,
+                                   'order2': level_id,
+                                   'category': 'main',
+                                   'outside_view': True,
+                                   'reactor_options': ''}
+                                  for level_id, name in zip(level_ids, names)])
+    Version.bump('levels')
+    db.session.commit()
+    level_registry.reload()
+    return level_ids
+
+
+def add_users(count):
+    """Adds users without passwords, so no time goes into hashing them."""
+    user_ids = reserve_ids(User.__table__, count)
+    bulk_insert(User.__table__, [{'user_id': user_id,
+                                  'username': 'bench{0}'.format(user_id),
+                                  'email': 'bench{0}@example.com'.format(user_id),
+                                  'password': ''}
+                                 for user_id in user_ids])
+    db.session.commit()
+    return user_ids
+
+
+def clear_solutions():
+    check_database()
+    for model in (UserRank, SolutionRank, Member, Pipe, Component, Solution):
+        db.session.execute(model.__table__.delete())
+    db.session.commit()
+
+
+def bench_process(upload_dir, repeats):
+    """Uploads the same save as a new user each time, starting from empty
+    leaderboards."""
+    results = []
+    for extension in ('user', 'gz'):
+        filename = 'bench.' + extension
+        write_save(os.path.join(upload_dir, filename), level_names(SAVE_LEVELS),
+                   SAVE_REACTORS, SAVE_MEMBERS, SAVE_PIPES)
+        savefile = []
+
+        def setup():
+            clear_solutions()
+            user_id, = add_users(1)
+            savefile[:] = [SaveFile(user_id)]
+            db.session.add(savefile[0])
+            db.session.commit()
+
+        times = timed(lambda: savefile[0].process(filename), repeats, setup)
+        results.append(result('SaveFile.process', times, format=extension, levels=SAVE_LEVELS,
+                              reactors=SAVE_REACTORS, members=SAVE_MEMBERS, pipes=SAVE_PIPES))
+    return results
+
+
+def bench_recalculate(sizes, repeats):
+    rng = random.Random(0)
+    results = []
+    for size in sizes:
+        level_id, = add_levels(['bench-ranking-{0}'.format(size)])
+        user_ids = add_users(max(1, size // SOLUTIONS_PER_USER))
+        uploaded = datetime(2011, 1, 1)
+        bulk_insert(Solution.__table__, [{'solution_id': solution_id,
+                                          'user_id': rng.choice(user_ids),
+                                          'level_id': level_id,
+                                          'cycle_count': rng.randint(50, 5000),
+                                          'symbol_count': rng.randint(5, 200),
+                                          'reactor_count': rng.randint(1, 3),
+                                          'upload_time': uploaded + timedelta(minutes=number),
+                                          'approved': True}
+                                         for number, solution_id in enumerate(reserve_ids(Solution.__table__, size))])
+        db.session.commit()
+
+        times = timed(lambda: SolutionRank.recalculate(level_id), max(1, min(repeats, repeats * 1000 // size)))
+        results.append(result('SolutionRank.recalculate', times, solutions=size))
+    return results
+
+
+def bench_solution(upload_dir, repeats):
+    """Uploads a save and times drawing its largest solution. The solution's
+    components are loaded before timing starts."""
+    clear_solutions()
+    user_id, = add_users(1)
+    savefile = SaveFile(user_id)
+    db.session.add(savefile)
+    db.session.commit()
+    write_save(os.path.join(upload_dir, 'solution.user'), level_names(SAVE_LEVELS),
+               SAVE_REACTORS, SAVE_MEMBERS, SAVE_PIPES)
+    savefile.process('solution.user')
+
+    solution = Solution.query.order_by(Solution.reactor_count.desc(), Solution.solution_id).first()
+    for component in solution.components:
+        component.members, component.pipes
+    solution.level.fixedcomponents, solution.user, solution.ranks
+    params = {'reactors': solution.reactor_count, 'members': SAVE_MEMBERS, 'pipes': SAVE_PIPES}
+
+    results = [result('process_solution', timed(lambda: process_solution(solution), repeats * 20), **params),
+               result('process_overview', timed(lambda: process_overview(solution), repeats * 20), **params)]
+
+    reactors = process_solution(solution)
+    overview = process_overview(solution)
+
+    def render():
+        render_template('solution.html',
+                        num_reactors=len(reactors),
+                        reactors=reactors,
+                        overview=overview,
+                        solution=solution,
+                        ELEMENTS=Member.ELEMENTS,
+                        PATH_NAMES=PATH_NAMES,
+                        form=SolutionForm(obj=solution))
+
+    render()
+    results.append(result('solution.html', timed(render, repeats * 20), **params))
+    return results
+
+
+def compare(results, path):
+    previous = dict((result_key(result), result) for result in json.load(open(path))['results'])
+    for result in results:
+        key = result_key(result)
+        if key in previous:
+            print('{0:<70} {1:6.2f}x'.format(key, result['min'] / previous[key]['min']))
+        else:
+            print('{0:<70}    new'.format(key))
+
+
+def main():
+    parser = OptionParser(usage='%prog [--output FILE] [--compare FILE] [--sizes N,...] [--repeats N]')
+    parser.add_option('--output', metavar='FILE', help='write the results to FILE as JSON')
+    parser.add_option('--compare', metavar='FILE', help='compare the results with an earlier --output')
+    parser.add_option('--sizes', default=','.join(str(size) for size in SIZES),
+                      help='solutions per level to rank [%default]')
+    parser.add_option('--repeats', type='int', default=REPEATS, help='times to run each benchmark [%default]')
+    options, args = parser.parse_args()
+    sizes = [int(size) for size in options.sizes.split(',')]
+
+    upload_dir = tempfile.mkdtemp()
+    try:
+        with app.test_request_context():
+            setup_database(upload_dir)
+            results = bench_process(upload_dir, options.repeats)
+            results += bench_recalculate(sizes, options.repeats)
+            results += bench_solution(upload_dir, options.repeats)
+    finally:
+        shutil.rmtree(upload_dir)
+
+    for result in results:
+        print('{0:<70} {1:10.3f} ms'.format(result_key(result), result['min'] * 1000))
+
+    if options.output:
+        output = open(options.output, 'w')
+        json.dump({'time': datetime.utcnow().isoformat(),
+                   'python': platform.python_version(),
+                   'sqlite': sqlite3.sqlite_version,
+                   'results': results},
+                  output, indent=2, sort_keys=True)
+        output.close()
+    if options.compare:
+        print('')
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main()
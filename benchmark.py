@@ -0,0 +1,231 @@
+"""Benchmarks the reactor grid and path tracer behind the solution page.
+
+process_solution is compared against the dict-of-sets implementation it
+replaced, on randomly generated multi-reactor solutions, after checking
+that both produce the same cells and paths.
+
+    python benchmark.py [reactors] [repeats]
+"""
+import random
+import sys
+import timeit
+
+from functions import PATH_NAMES, REACTOR_HEIGHT, REACTOR_WIDTH, process_solution
+
+
+class BenchMember(object):
+    """Stands in for Member, without needing a database."""
+
+    ARROW_DIRS = {180: "l", -90: "u", 0: "r", 90: "d"}
+
+    def __init__(self, type, color, x, y, arrow_dir=0, element=0):
+        self.type = type
+        self.color = color
+        self.x = x
+        self.y = y
+        self.arrow_dir = arrow_dir
+        self.element = element
+
+    @property
+    def image_name(self):
+        return self.color+'-'+self.type+'.png'
+
+    @property
+    def sprite_class(self):
+        return 'sprite-'+self.image_name[:-len('.png')]
+
+
+class BenchComponent(object):
+    def __init__(self, members):
+        self.type = 'drag-assembly-reactor'
+        self.members = members
+
+
+class BenchSolution(object):
+    def __init__(self, components):
+        self.components = components
+
+
+INSTRUCTIONS = ('instr-grab', 'instr-bond', 'instr-rotate', 'instr-sync', 'instr-input', 'instr-output',
+                'instr-sensor', 'instr-toggle', 'instr-control')
+
+
+def random_solution(num_reactors, instructions_per_color=25, arrows_per_color=20, seed=0):
+    rng = random.Random(seed)
+    arrow_dirs = list(BenchMember.ARROW_DIRS.keys())
+    components = []
+    for reactor in range(num_reactors):
+        members = []
+        for color in ('blue', 'red'):
+            cells = [(x, y) for x in range(REACTOR_WIDTH) for y in range(REACTOR_HEIGHT)]
+            rng.shuffle(cells)
+            x, y = cells.pop()
+            members.append(BenchMember('instr-start', color, x, y, rng.choice(arrow_dirs)))
+            for i in range(instructions_per_color):
+                x, y = cells.pop()
+                members.append(BenchMember(rng.choice(INSTRUCTIONS), color, x, y, rng.choice(arrow_dirs), rng.randint(1, 20)))
+
+            # arrows can share a cell with another instruction
+            rng.shuffle(cells)
+            for i in range(arrows_per_color):
+                x, y = cells.pop()
+                members.append(BenchMember('instr-arrow', color, x, y, rng.choice(arrow_dirs)))
+        components.append(BenchComponent(members))
+    return BenchSolution(components)
+
+
+# the implementation process_solution replaced, kept for comparison
+def process_solution_dicts(solution):
+    reactors = []
+    path = {}
+
+    # for each reactor, create a 10x8 2D dict of "cells"
+    # each cell is a list of tuples, representing type, color/class, and optional text (for sensors) for each member in the cell
+    for component in solution.components:
+        if "reactor" in component.type:
+            cells = {}
+            path = {}
+            paths_to_process = []
+            for path_color in ('blue', 'red'):
+                path[path_color] = {}
+            for y in range(0, 8):
+                for x in range(0, 10):
+                    cells[(x, y)] = []
+                    for path_color in ('blue', 'red'):
+                        path[path_color][(x, y)] = {}
+                        path[path_color][(x, y)]['edges'] = set()
+                        path[path_color][(x, y)]['entry_edges'] = set()
+                        path[path_color][(x, y)]['dir_change'] = ''
+
+            # add all the instructions to the cell grid
+            for member in component.members:
+                # take note of any instructions that start a path, for path-building later
+                if member.type in ('instr-start', 'instr-toggle', 'instr-sensor', 'instr-control'):
+                    new_path = {}
+                    new_path['start_type'] = member.type
+                    new_path['start_pos'] = (member.x, member.y)
+                    new_path['start_dir'] = member.ARROW_DIRS[member.arrow_dir]
+                    new_path['color'] = member.color
+                    paths_to_process.append(new_path)
+
+                # take note of any direction changes (arrow)
+                if member.type == 'instr-arrow':
+                    path[member.color][(member.x, member.y)]['dir_change'] = member.ARROW_DIRS[member.arrow_dir]
+
+                # set up the class to give to img and div tags, color unless it's a directional
+                if member.type == 'instr-arrow':
+                    member_class = member.color+'-arrow'
+                elif member.type in ('instr-start', 'instr-toggle', 'instr-sensor', 'instr-control'):
+                    member_class = member.color+" "+member.ARROW_DIRS[member.arrow_dir]
+                else:
+                    member_class = member.color
+
+                # if it's a fuser/splitter, we need to add the other half to the cell to the right as well
+                if member.type in ('feature-fuser', 'feature-splitter') and member.x < 9:
+                    cells[(member.x+1, member.y)].append((member.image_name.replace('.png', '2.png'), member_class))
+
+                if member.type == 'instr-sensor':
+                    cells[(member.x, member.y)].append((member.image_name, member_class, member.element))
+                else:
+                    cells[(member.x, member.y)].append((member.image_name, member_class))
+
+            # build the paths
+            OPPOSITE_SIDE = {"l": "r",
+                             "r": "l",
+                             "u": "d",
+                             "d": "u"}
+            while len(paths_to_process) > 0:
+                current_path = paths_to_process.pop(0)
+                current_pos = list(current_path['start_pos'])
+                # arrows in the same cell as a start instruction override its direction
+                if current_path['start_type'] == 'instr-start':
+                    current_dir = path[current_path['color']][tuple(current_pos)]['dir_change'] or current_path['start_dir']
+                else:
+                    current_dir = current_path['start_dir']
+                path[current_path['color']][tuple(current_pos)]['edges'].add(current_dir)
+                while True:
+                    # move position
+                    if current_dir == 'l':
+                        current_pos[0] -= 1
+                    elif current_dir == 'r':
+                        current_pos[0] += 1
+                    elif current_dir == 'u':
+                        current_pos[1] -= 1
+                    elif current_dir == 'd':
+                        current_pos[1] += 1
+
+                    # if we're now outside the graph, stop
+                    if not (0 <= current_pos[0] <= 9 and 0 <= current_pos[1] <= 7):
+                        break
+
+                    # if we've already come into this cell from this direction, stop
+                    if OPPOSITE_SIDE[current_dir] in path[current_path['color']][tuple(current_pos)]['entry_edges']:
+                        break
+
+                    # otherwise, mark the incoming edge
+                    path[current_path['color']][tuple(current_pos)]['edges'].add(OPPOSITE_SIDE[current_dir])
+                    path[current_path['color']][tuple(current_pos)]['entry_edges'].add(OPPOSITE_SIDE[current_dir])
+
+                    # determine if we're changing direction or going straight through
+                    if path[current_path['color']][tuple(current_pos)]['dir_change']:
+                        current_dir = path[current_path['color']][tuple(current_pos)]['dir_change']
+
+                    # mark outgoing edge
+                    path[current_path['color']][tuple(current_pos)]['edges'].add(current_dir)
+
+            reactors.append((cells, path, component.type))
+
+    return reactors
+
+
+def same_output(reactors, old_reactors):
+    for (cells, paths, type), (old_cells, old_paths, old_type) in zip(reactors, old_reactors):
+        for y in range(REACTOR_HEIGHT):
+            for x in range(REACTOR_WIDTH):
+                cell = y * REACTOR_WIDTH + x
+                old_cell = [('sprite-'+member[0].replace('.png', ''),) + member[1:] for member in old_cells[(x, y)]]
+                if cells[cell] != old_cell:
+                    return False
+                for path_color in ('blue', 'red'):
+                    if PATH_NAMES[paths[path_color][cell]] != ''.join(sorted(old_paths[path_color][(x, y)]['edges'])):
+                        return False
+    return len(reactors) == len(old_reactors)
+
+
+def deep_size(obj, seen=None):
+    """Returns the memory used by obj and everything it contains, in bytes."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    return size
+
+
+def main():
+    num_reactors = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    solution = random_solution(num_reactors)
+
+    if not same_output(process_solution(solution), process_solution_dicts(solution)):
+        sys.exit('process_solution output differs from the dict-based implementation')
+
+    new_time = min(timeit.repeat(lambda: process_solution(solution), number=repeats, repeat=3)) / repeats
+    old_time = min(timeit.repeat(lambda: process_solution_dicts(solution), number=repeats, repeat=3)) / repeats
+    new_size = deep_size(process_solution(solution))
+    old_size = deep_size(process_solution_dicts(solution))
+
+    print('process_solution, {0} reactors'.format(num_reactors))
+    print('  dict-based: {0:8.3f} ms {1:9d} bytes'.format(old_time * 1000, old_size))
+    print('  bitmask:    {0:8.3f} ms {1:9d} bytes'.format(new_time * 1000, new_size))
+    print('  {0:.1f}x faster, {1:.1f}x smaller'.format(old_time / new_time, float(old_size) / new_size))
+
+
+if __name__ == '__main__':
+    main()
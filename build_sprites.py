@@ -0,0 +1,173 @@
+"""Packs the images in static/members/ into sprite atlases, and writes the
+CSS classes that show each image out of them.
+
+    python build_sprites.py
+
+Needs to be re-run whenever an image in static/members/ is added or changed.
+The full-cell (78x78) images and the smaller instruction icons go into
+separate atlases, since each packs best into a grid of its own size.
+"""
+import os
+import struct
+import zlib
+
+
+MEMBERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'members')
+STATIC_DIR = os.path.dirname(MEMBERS_DIR)
+CSS_FILE = os.path.join(STATIC_DIR, 'sprites.css')
+
+# images at least this big go in the large atlas
+LARGE_SIZE = 78
+ATLAS_COLUMNS = 8
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def read_png(path):
+    """Returns (width, height, rows) for a non-interlaced 8-bit palette or
+    RGBA PNG, with rows as lists of RGBA bytearrays."""
+    data = open(path, 'rb').read()
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError('{0} is not a PNG'.format(path))
+
+    palette = None
+    transparency = bytearray()
+    compressed = []
+    pos = 8
+    while pos < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += length + 12
+        if chunk_type == b'IHDR':
+            width, height, depth, color_type, compression, filtering, interlace = struct.unpack('>IIBBBBB', chunk)
+            if depth != 8 or color_type not in (3, 6) or interlace:
+                raise ValueError('{0} is not an 8-bit palette or RGBA PNG'.format(path))
+        elif chunk_type == b'PLTE':
+            palette = bytearray(chunk)
+        elif chunk_type == b'tRNS':
+            transparency = bytearray(chunk)
+        elif chunk_type == b'IDAT':
+            compressed.append(chunk)
+        elif chunk_type == b'IEND':
+            break
+
+    bpp = 4 if color_type == 6 else 1
+    stride = width * bpp
+    raw = bytearray(zlib.decompress(b''.join(compressed)))
+    previous = bytearray(stride)
+    rows = []
+    for y in range(height):
+        start = y * (stride + 1)
+        filter_type = raw[start]
+        line = raw[start + 1:start + 1 + stride]
+        unfilter(line, previous, filter_type, bpp)
+        previous = line
+
+        if color_type == 6:
+            rows.append(line)
+        else:
+            row = bytearray()
+            for index in line:
+                alpha = transparency[index] if index < len(transparency) else 255
+                row += palette[index * 3:index * 3 + 3]
+                row.append(alpha)
+            rows.append(row)
+
+    return (width, height, rows)
+
+
+def unfilter(line, previous, filter_type, bpp):
+    for i in range(len(line)):
+        left = line[i - bpp] if i >= bpp else 0
+        up = previous[i]
+        if filter_type == 1:
+            line[i] = (line[i] + left) & 0xff
+        elif filter_type == 2:
+            line[i] = (line[i] + up) & 0xff
+        elif filter_type == 3:
+            line[i] = (line[i] + ((left + up) >> 1)) & 0xff
+        elif filter_type == 4:
+            up_left = previous[i - bpp] if i >= bpp else 0
+            estimate = left + up - up_left
+            distances = (abs(estimate - left), abs(estimate - up), abs(estimate - up_left))
+            if distances[0] <= distances[1] and distances[0] <= distances[2]:
+                predictor = left
+            elif distances[1] <= distances[2]:
+                predictor = up
+            else:
+                predictor = up_left
+            line[i] = (line[i] + predictor) & 0xff
+
+
+def write_png(path, width, height, rows):
+    def chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data +
+                struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    raw = bytearray()
+    for row in rows:
+        raw.append(0)
+        raw += row
+
+    output = open(path, 'wb')
+    output.write(PNG_SIGNATURE)
+    output.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+    output.write(chunk(b'IDAT', zlib.compress(bytes(raw), 9)))
+    output.write(chunk(b'IEND', b''))
+    output.close()
+
+
+def offset(pixels):
+    if pixels:
+        return '-{0}px'.format(pixels)
+    return '0'
+
+
+def build_atlas(filename, images):
+    """Lays images out on a grid of cells as big as the largest of them, and
+    returns the CSS rules for each one."""
+    cell_width = max(image[1] for image in images)
+    cell_height = max(image[2] for image in images)
+    columns = min(ATLAS_COLUMNS, len(images))
+    atlas_width = columns * cell_width
+    atlas_height = ((len(images) + columns - 1) // columns) * cell_height
+    atlas = [bytearray(atlas_width * 4) for y in range(atlas_height)]
+
+    css = []
+    for i, (name, width, height, rows) in enumerate(images):
+        left = (i % columns) * cell_width
+        top = (i // columns) * cell_height
+        for y, row in enumerate(rows):
+            atlas[top + y][left * 4:(left + width) * 4] = row
+        css.append('.sprite-{0} {{ background-image: url(/static/{1}); background-position: {2} {3}; '
+                   'width: {4}px; height: {5}px; }}'.format(name, filename, offset(left), offset(top), width, height))
+
+    write_png(os.path.join(STATIC_DIR, filename), atlas_width, atlas_height, atlas)
+    return css
+
+
+def main():
+    large = []
+    small = []
+    for filename in sorted(os.listdir(MEMBERS_DIR)):
+        if not filename.endswith('.png'):
+            continue
+        width, height, rows = read_png(os.path.join(MEMBERS_DIR, filename))
+        image = (filename[:-len('.png')], width, height, rows)
+        if width >= LARGE_SIZE or height >= LARGE_SIZE:
+            large.append(image)
+        else:
+            small.append(image)
+
+    css = ['/* generated by build_sprites.py from static/members/, do not edit */',
+           '.sprite { display: inline-block; background-repeat: no-repeat; }']
+    css += build_atlas('sprites-large.png', large)
+    css += build_atlas('sprites-small.png', small)
+
+    output = open(CSS_FILE, 'w')
+    output.write('\n'.join(css) + '\n')
+    output.close()
+
+
+if __name__ == '__main__':
+    main()
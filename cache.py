@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from functools import wraps
+import cPickle as pickle
+import hashlib
+import socket
+import threading
+import time
+
+from flask import request, session
+
+
+class LRUCache(object):
+    """An in-process cache holding at most max_size items, dropping the least
+    recently used item when it's full. Safe to share between threads."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, expires = self.items.pop(key)
+            except KeyError:
+                return default
+            if expires and expires < time.time():
+                return default
+            self.items[key] = (value, expires)
+            return value
+
+    def set(self, key, value, timeout=0):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (value, time.time() + timeout if timeout else None)
+            if len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+
+class MemcacheCache(object):
+    """The same interface as LRUCache, stored on a server that speaks the
+    memcached text protocol (memcached itself, or anything compatible), so
+    the cache is shared between all the web processes.
+
+    Any error talking to the server is treated as a cache miss.
+    """
+
+    def __init__(self, server, timeout=1):
+        host, port = server.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.timeout = timeout
+        # one connection per thread, the protocol has no request ids
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'socket', None) is None:
+            self.local.socket = socket.create_connection(self.address, self.timeout)
+            self.local.file = self.local.socket.makefile('rb')
+        return self.local.socket, self.local.file
+
+    def disconnect(self):
+        if getattr(self.local, 'socket', None) is not None:
+            self.local.socket.close()
+        self.local.socket = None
+
+    def command(self, line, data=None):
+        """Sends a command, and returns the first line of the reply along with
+        the file to read the rest of it from."""
+        sock, reply = self.connection()
+        if data is not None:
+            line += '\r\n' + data
+        sock.sendall(line + '\r\n')
+        return reply.readline().rstrip('\r\n'), reply
+
+    def get(self, key, default=None):
+        try:
+            line, reply = self.command('get ' + key)
+            if line == 'END':
+                return default
+            length = int(line.split()[3])
+            data = reply.read(length + 2)[:-2]
+            reply.readline()  # END
+            return pickle.loads(data)
+        except (socket.error, ValueError, IndexError, pickle.UnpicklingError):
+            self.disconnect()
+            return default
+
+    def set(self, key, value, timeout=0):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        try:
+            self.command('set {0} 0 {1} {2}'.format(key, int(timeout), len(data)), data)
+        except socket.error:
+            self.disconnect()
+
+    def delete(self, key):
+        try:
+            self.command('delete ' + key)
+        except socket.error:
+            self.disconnect()
+
+
+class PageCache(object):
+    """Caches the pages anonymous visitors see, in any backend with the
+    LRUCache interface.
+
+    Each page is stored under its URL plus the current version of everything
+    it's built from (a level's ranks and scores, or the list of levels).
+    Bumping a version makes every page built from the old one unreachable, and
+    the backend drops them once they're least recently used or time out.
+    """
+
+    def __init__(self, backend, timeout=0):
+        self.backend = backend
+        self.timeout = timeout
+
+    def version(self, name):
+        version = self.backend.get('version:' + name)
+        if version is None:
+            version = self.bump(name)
+        return version
+
+    def bump(self, name):
+        # a fresh value from the clock rather than a counter, so a version
+        # that was evicted and recreated can't match pages cached before
+        version = '{0:x}'.format(int(time.time() * 1000000))
+        self.backend.set('version:' + name, version)
+        return version
+
+    def key(self, versions):
+        key = request.path + '?' + request.query_string
+        for name in versions:
+            key += ' ' + name + '=' + self.version(name)
+        # memcached keys are limited to 250 characters with no spaces
+        return 'page:' + hashlib.sha1(key).hexdigest()
+
+    def cached(self, versions):
+        """Decorates a view to cache its pages for anonymous visitors. versions
+        is called with the view's arguments and returns the names of the
+        versions its page is built from."""
+        def decorator(view):
+            @wraps(view)
+            def cached_view(**kwargs):
+                # logged in users and flashed messages change the page
+                if session.get('username') or session.get('_flashes') or request.method != 'GET':
+                    return view(**kwargs)
+
+                key = self.key(versions(**kwargs))
+                page = self.backend.get(key)
+                if page is None:
+                    page = view(**kwargs)
+                    if isinstance(page, basestring):
+                        self.backend.set(key, page, self.timeout)
+                return page
+            return cached_view
+        return decorator
+
+
+def make_backend(config, size):
+    """Returns the cache backend named by the PAGE_CACHE setting."""
+    if config.get('PAGE_CACHE', 'lru') == 'memcache':
+        return MemcacheCache(config['MEMCACHE_SERVER'])
+    return LRUCache(size)
@@ -0,0 +1,174 @@
+"""Checks that the queries behind each page are answered from indexes.
+
+    python check_query_plans.py [--verbose]
+
+Fills an in-memory SQLite database with generated saves (using
+bench_suite.py and savegen.py), then runs EXPLAIN QUERY PLAN on every query
+in hot_queries() and fails if any query reads a whole table. The queries
+come from the same helpers the pages use, so they can't drift apart. Exits
+with status 1 if any query failed.
+"""
+from optparse import OptionParser
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from sqlalchemy import func
+from sqlalchemy.sql.expression import text
+
+# bench_suite switches to an in-memory database, so it comes before the
+# modules that connect
+from bench_suite import SAVE_MEMBERS, SAVE_PIPES, SAVE_REACTORS, add_users, setup_database
+from models import (COPY_USER_RANKS, RANKED_BOARDS, Component, FixedComponent, Leaderboard, Member, OutgoingEmail,
+                    OfficialScores, Pipe, SaveFile, Solution, SolutionRank, User, UserRank, db, sorts_before)
+from savegen import level_names, write_save
+from spacechem import LEADERBOARD_PAGE_SIZE, app
+
+
+SQLITE_SCAN_PATTERN = re.compile(r'^SCAN (\w+)')
+# tables aliased by SQLAlchemy, such as solutions_1
+ALIAS_PATTERN = re.compile(r'_\d+$')
+
+# the seeded database: users who each upload a save with this many levels
+SEED_USERS = 3
+SEED_LEVELS = 10
+
+
+def seed(upload_dir):
+    setup_database(upload_dir)
+    for user_id in add_users(SEED_USERS):
+        filename = 'seed{0}.user'.format(user_id)
+        write_save(os.path.join(upload_dir, filename), level_names(SEED_LEVELS),
+                   SAVE_REACTORS, SAVE_MEMBERS, SAVE_PIPES, seed=user_id)
+        savefile = SaveFile(user_id)
+        db.session.add(savefile)
+        db.session.commit()
+        savefile.process(filename)
+
+
+def sample(column):
+    """Returns the value of column in some row, to query with."""
+    return db.session.query(column).filter(column != None).limit(1).scalar()
+
+
+def hot_queries():
+    """Returns (name, query) pairs for the queries run by the site's pages
+    and by ranking. A query is a Query, or a (sql, params) pair for the
+    statements that are written out as SQL."""
+    solution = Solution.query.filter(Solution.approved == True).first()
+    solution_id, level_id, user_id = solution.solution_id, solution.level_id, solution.user_id
+    username = db.session.query(User.username).filter(User.user_id == user_id).scalar()
+    component_id = sample(Component.component_id)
+    first_board = RANKED_BOARDS[0].leaderboard_id
+
+    queries = [
+        ('leaderboard by slug', Leaderboard.query.filter_by(slug=sample(Leaderboard.slug))),
+        ('user by username', User.query.filter_by(username=username)),
+        ('leaderboard page', SolutionRank.page(first_board, level_id, 0, 0, LEADERBOARD_PAGE_SIZE + 1)),
+        ('newest official scores', OfficialScores.newest(level_id)),
+        ('scores since keyframe', OfficialScores.since_keyframe([level_id])),
+        ('best solution', SolutionRank.best(first_board, level_id)),
+        ('user page solutions', Solution.for_user_page(user_id)),
+        ('user page ranks', UserRank.query.filter_by(user_id=user_id)),
+        ('unapproved solutions', Solution.unapproved_for_user(user_id)),
+        ('previous uploads', Solution.previous_uploads(user_id)),
+        ('solution', Solution.with_details(solution_id)),
+        ('solution components', Component.for_solution(solution_id)),
+        # what the relationships load
+        ('component members', Member.query.filter(Member.component_id == component_id)),
+        ('component pipes', Pipe.query.filter(Pipe.component_id == component_id)),
+        ('fixed components', FixedComponent.query
+                             .filter(FixedComponent.level_id == level_id)
+                             .order_by(FixedComponent.x, FixedComponent.y)),
+        ('reactor options', SolutionRank.reactor_counts(level_id)),
+        ('user ranks copy', (COPY_USER_RANKS, {'level_id': level_id})),
+        ('due emails', OutgoingEmail.due(func.now(), 50)),
+        ('ranking', SolutionRank.ranked_solutions(level_id)),
+    ]
+
+    for ranked_board in RANKED_BOARDS:
+        leaderboard_id = ranked_board.leaderboard_id
+        columns = [getattr(Solution, name) for name in ranked_board.order]
+        entries = SolutionRank.entries(leaderboard_id, level_id, 0)
+        queries += [
+            ('current entry {0}'.format(leaderboard_id), entries.filter(Solution.user_id == user_id)),
+            ('rank placement {0}'.format(leaderboard_id),
+             entries.filter(sorts_before(columns, [getattr(solution, name) for name in ranked_board.order]))),
+            ('shifted ranks {0}'.format(leaderboard_id),
+             SolutionRank.board(leaderboard_id, level_id, 0).filter(SolutionRank.rank >= 1)),
+            ('runner up {0}'.format(leaderboard_id), SolutionRank.runner_up(solution, ranked_board, 0)),
+        ]
+    return queries
+
+
+def compile_query(query):
+    """Returns the SQL and DB-API parameters for a query."""
+    if isinstance(query, tuple):
+        statement, params = text(query[0]), query[1]
+    else:
+        statement, params = query.statement, {}
+    compiled = statement.compile(dialect=db.engine.dialect)
+    values = dict(compiled.params)
+    values.update(params)
+    if compiled.positional:
+        return str(compiled), [values[name] for name in compiled.positiontup]
+    return str(compiled), values
+
+
+def explain(cursor, sql, params):
+    """Returns the query plan as a list of lines, and the lines that show a
+    table being read in full."""
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    lines = [row[-1] for row in cursor.fetchall()]
+    scans = []
+    for line in lines:
+        match = SQLITE_SCAN_PATTERN.match(line)
+        # scanning an index or a subquery's results is fine
+        if match and 'USING' not in line and ALIAS_PATTERN.sub('', match.group(1)) in db.metadata.tables:
+            scans.append(line)
+    return lines, scans
+
+
+def check(verbose):
+    """Explains every hot query, printing the plans of those that read a
+    whole table (or of all of them if verbose), and returns how many did."""
+    connection = db.engine.raw_connection()
+    cursor = connection.cursor()
+    failed = 0
+    for name, query in hot_queries():
+        sql, params = compile_query(query)
+        lines, scans = explain(cursor, sql, params)
+        if scans:
+            failed += 1
+        print('{0:<26} {1}'.format(name, 'FULL SCAN' if scans else 'ok'))
+        if scans or verbose:
+            print('    ' + sql.replace('\n', '\n    '))
+            for line in lines:
+                print('    | ' + line)
+    connection.close()
+    return failed
+
+
+def main():
+    parser = OptionParser(usage='%prog [--verbose]')
+    parser.add_option('--verbose', action='store_true', default=False,
+                      help='print every query plan, not just the failing ones')
+    options, args = parser.parse_args()
+
+    upload_dir = tempfile.mkdtemp()
+    try:
+        with app.test_request_context():
+            seed(upload_dir)
+            failed = check(options.verbose)
+    finally:
+        shutil.rmtree(upload_dir)
+
+    if failed:
+        print('{0} queries read a whole table'.format(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+from models import Level, SolutionRank, db
+
+
+# compare every level's stored ranks against a full recalculation, and
+# rebuild any that have drifted out of sync
+# anything derived from the ranks is refreshed for every level either way
+for level in Level.query.all():
+    if not SolutionRank.verify(level.level_id):
+        print('Ranks for {0} were out of date, rebuilding'.format(level.slug))
+        SolutionRank.recalculate(level.level_id)
+    else:
+        SolutionRank.ranks_changed(level.level_id)
+        db.session.commit()
@@ -16,7 +16,7 @@ from flaskext.wtf import (
 import models
 
 
-savefiles = UploadSet('savefiles', ('user','zip'))
+savefiles = UploadSet('savefiles', ('user', 'zip', 'gz'))
 
 
 class RegistrationForm(Form):
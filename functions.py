@@ -1,7 +1,15 @@
-from cgi import escape
+from array import array
 from collections import defaultdict
+import cPickle as pickle
+import hashlib
+from itertools import groupby
+from operator import getitem
+import sqlite3
+import zlib
 
-from boto.ses import SESConnection
+
+# the percentiles of official solutions shown on the stats pages
+PERCENTILES = (10, 25, 50, 75, 90)
 
 
 def first_nonzero_index(input_list):
@@ -20,6 +28,17 @@ def last_nonzero_index(input_list):
         return len(input_list) - index
 
 
+def ordinal(number):
+    if number % 10 == 1 and number % 100 != 11:
+        return str(number) + 'st'
+    elif number % 10 == 2 and number % 100 != 12:
+        return str(number) + 'nd'
+    elif number % 10 == 3 and number % 100 != 13:
+        return str(number) + 'rd'
+    else:
+        return str(number) + 'th'
+
+
 def calculate_mean(data, start, step_size):
     total = 0
     for i, item in enumerate(data):
@@ -36,63 +55,233 @@ def process_chart_data(data, output, prefix):
     last_nonzero = last_nonzero_index(data)
 
     output[prefix+'_data'] = ','.join(map(str, data[first_nonzero:last_nonzero+1]))
-    output[prefix+'_labels'] = str()
-    for item in range(first_nonzero * step_size + start, last_nonzero * step_size + 1, step_size):
-        output[prefix+'_labels'] += "'"+str(item)
-        if (step_size > 1):
-            output[prefix+'_labels'] += '-' + str(item + (step_size - 1))
-        output[prefix+'_labels'] += "',"
-    output[prefix+'_labels'] = output[prefix+'_labels'][:-1]
+    if step_size > 1:
+        labels = ["'{0}-{1}'".format(item, item + step_size - 1)
+                  for item in range(first_nonzero * step_size + start, last_nonzero * step_size + 1, step_size)]
+    else:
+        labels = ["'{0}'".format(item)
+                  for item in range(first_nonzero * step_size + start, last_nonzero * step_size + 1, step_size)]
+    output[prefix+'_labels'] = ','.join(labels)
     output[prefix+'_mean'] = calculate_mean(data, start, step_size)
+    output[prefix+'_percentiles'] = calculate_percentiles(data, start, step_size)
+
+
+def calculate_percentiles(data, start, step_size):
+    """Returns (percent, value) pairs for each of PERCENTILES, where that
+    percent of the solutions are at or below value. Bucketed data can only
+    tell which bucket that is, so value is the end of the bucket."""
+    total = sum(data)
+    percentiles = []
+    if not total:
+        return percentiles
+
+    running = 0
+    percents = iter(PERCENTILES)
+    percent = next(percents)
+    for i, item in enumerate(data):
+        running += item
+        while percent is not None and running * 100 >= percent * total:
+            percentiles.append((percent, start + i * step_size + step_size - 1))
+            percent = next(percents, None)
+    return percentiles
+
+
+def build_chart_data(reactors, symbols, cycles):
+    """Works out everything the solution stats page draws from a level's
+    three official histograms."""
+    chart_data = dict()
+
+    # use reactor sum for total because the other ones can have solutions "off the chart" that aren't counted
+    chart_data['total_solutions'] = sum(reactors[6:])
+
+    process_chart_data(reactors, chart_data, 'reactor')
+    process_chart_data(cycles, chart_data, 'cycle')
+    process_chart_data(symbols, chart_data, 'symbol')
+    return chart_data
+
+
+def parse_histogram(counts):
+    """Reads a histogram in the official scores' format, a space-separated
+    list of (float formatted) numbers."""
+    return [int(float(count)) for count in counts.split()]
+
+
+def pack_histogram(counts):
+    return array('i', counts).tostring()
+
+
+def pack_delta(counts, previous):
+    """Packs the changes from previous to counts, which are mostly zeros and
+    so compress well."""
+    return zlib.compress(pack_histogram([count - previous_count
+                                         for count, previous_count in zip(counts, previous)]))
+
+
+def apply_delta(previous, data):
+    return [previous_count + change
+            for previous_count, change in zip(previous, unpack_histogram(zlib.decompress(data)))]
+
 
+def histogram_hash(reactors, symbols, cycles):
+    return hashlib.sha1(''.join(pack_histogram(counts) for counts in (reactors, symbols, cycles))).hexdigest()
 
-def ses_email(config, to_address, subject, body):
-    connection = SESConnection(aws_access_key_id=config['AWS_ACCESS_KEY_ID'],
-                               aws_secret_access_key=config['AWS_SECRET_ACCESS_KEY_ID'])
-    from_address = '"SolutionNet" <{0}>'.format(config['FROM_EMAIL_ADDRESS'])
 
-    connection.send_email(from_address,
-                          str(subject),
-                          str(escape(body)),
-                          str(to_address))
+def unpack_histogram(data):
+    counts = array('i')
+    counts.fromstring(data)
+    return counts.tolist()
+
+
+class SortedGroups(object):
+    """Hands out groups of rows from a result set sorted on key, in ascending
+    key order. Groups for keys that are never asked for are skipped over."""
+
+    def __init__(self, rows, key):
+        self.groups = groupby(rows, key)
+        self.current = next(self.groups, None)
+
+    def take(self, key):
+        while self.current is not None and self.current[0] < key:
+            self.current = next(self.groups, None)
+        if self.current is None or self.current[0] != key:
+            return []
+        rows = list(self.current[1])
+        self.current = next(self.groups, None)
+        return rows
+
+
+def read_savefile(conn, level_names):
+    """Generates (level_name, level_row, components) for every passed level in
+    a SpaceChem save (an open SQLite connection) whose internal name is in
+    level_names. components is a list of (component_row, member_rows,
+    pipe_rows) tuples.
+
+    Each table is read with a single query sorted by level and component, and
+    the result sets are merged as they stream in, so only one level's rows are
+    held in memory at a time.
+    """
+    conn.row_factory = sqlite3.Row
+    level_rows = conn.execute("SELECT * FROM Level WHERE passed = 1 ORDER BY id")
+    components = SortedGroups(conn.execute("SELECT * FROM Component ORDER BY level_id, rowid"),
+                              lambda row: row['level_id'])
+    members = SortedGroups(conn.execute("SELECT Member.*, Component.level_id AS component_level_id "
+                                        "FROM Member JOIN Component ON Member.component_id = Component.rowid "
+                                        "ORDER BY Component.level_id, Member.component_id"),
+                           lambda row: (row['component_level_id'], row['component_id']))
+    pipes = SortedGroups(conn.execute("SELECT Pipe.*, Component.level_id AS component_level_id "
+                                      "FROM Pipe JOIN Component ON Pipe.component_id = Component.rowid "
+                                      "ORDER BY Component.level_id, Pipe.component_id"),
+                         lambda row: (row['component_level_id'], row['component_id']))
+
+    for level_row in level_rows:
+        level_name = level_row['id']
+        component_rows = components.take(level_name)
+        if level_name not in level_names:
+            continue
+
+        graph = []
+        for component_row in component_rows:
+            key = (level_name, component_row['rowid'])
+            graph.append((component_row, members.take(key), pipes.take(key)))
+        yield (level_name, level_row, graph)
+
+
+COMPONENT_FIELDS = ('type', 'x', 'y')
+MEMBER_FIELDS = ('type', 'arrow_dir', 'choice', 'layer', 'x', 'y', 'element_type', 'element')
+PIPE_FIELDS = ('output_id', 'x', 'y')
+
+
+def solution_hash(level_id, components, get=getitem):
+    """Returns a fingerprint of a solution's layout, as a hex SHA-1 digest.
+
+    components is a list of (component, members, pipes) tuples, and get is
+    used to read fields off each of them (getitem for save file rows, getattr
+    for model objects). Components, members and pipes are sorted first, so the
+    hash doesn't depend on the order they were stored in.
+    """
+    def fields(obj, names):
+        return ' '.join(u'{0}'.format(get(obj, name)) for name in names)
+
+    blocks = []
+    for component, members, pipes in components:
+        lines = ['C '+fields(component, COMPONENT_FIELDS)]
+        lines += sorted('M '+fields(member, MEMBER_FIELDS) for member in members)
+        lines += sorted('P '+fields(pipe, PIPE_FIELDS) for pipe in pipes)
+        blocks.append('\n'.join(lines))
+
+    content = u'{0}\n'.format(level_id) + '\n'.join(sorted(blocks))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+# bump this whenever process_solution or process_overview change what they
+# return, so that stored render models get rebuilt
+RENDER_VERSION = 3
+
+REACTOR_WIDTH = 10
+REACTOR_HEIGHT = 8
+REACTOR_CELLS = REACTOR_WIDTH * REACTOR_HEIGHT
+
+# directions are stored as small ints, which index into these tuples
+DIRECTIONS = ('l', 'u', 'r', 'd')
+DIRECTION_X = (-1, 0, 1, 0)
+DIRECTION_Y = (0, -1, 0, 1)
+OPPOSITE_DIRECTION = (2, 3, 0, 1)
+NO_DIRECTION = -1
+
+# Member.arrow_dir values to directions
+DIRECTION_CODES = {180: 0, -90: 1, 0: 2, 90: 3}
+
+# path edge masks to the suffix of their image names, with the edges in
+# alphabetical order ("dl", "lru", etc.)
+PATH_NAMES = tuple(''.join(sorted(DIRECTIONS[direction]
+                                  for direction in range(4)
+                                  if mask & (1 << direction)))
+                   for mask in range(16))
+
+
+def pack_render(model):
+    return zlib.compress(pickle.dumps(model, pickle.HIGHEST_PROTOCOL))
+
+
+def unpack_render(data):
+    return pickle.loads(zlib.decompress(data))
 
 
 def process_solution(solution):
     reactors = []
-    path = {}
 
-    # for each reactor, create a 10x8 2D dict of "cells"
-    # each cell is a list of tuples, representing type, color/class, and optional text (for sensors) for each member in the cell
+    # each reactor is a 10x8 grid, stored as flat lists/arrays of 80 cells
+    # indexed by y * REACTOR_WIDTH + x
+    # cells holds a list of tuples for each cell, representing sprite, color/class,
+    # and optional text (for sensors) for each member in the cell
+    # paths holds a 4-bit mask per cell for each color, of the edges its path crosses
     for component in solution.components:
         if "reactor" in component.type:
-            cells = {}
-            path = {}
+            cells = [[] for cell in range(REACTOR_CELLS)]
+            paths = {}
+            entry_edges = {}
+            dir_changes = {}
             paths_to_process = []
             for path_color in ('blue', 'red'):
-                path[path_color] = {}
-            for y in range(0, 8):
-                for x in range(0, 10):
-                    cells[(x, y)] = []
-                    for path_color in ('blue', 'red'):
-                        path[path_color][(x, y)] = {}
-                        path[path_color][(x, y)]['edges'] = set()
-                        path[path_color][(x, y)]['entry_edges'] = set()
-                        path[path_color][(x, y)]['dir_change'] = ''
+                paths[path_color] = array('B', [0]) * REACTOR_CELLS
+                entry_edges[path_color] = array('B', [0]) * REACTOR_CELLS
+                dir_changes[path_color] = array('b', [NO_DIRECTION]) * REACTOR_CELLS
 
             # add all the instructions to the cell grid
             for member in component.members:
+                cell = member.y * REACTOR_WIDTH + member.x
+
                 # take note of any instructions that start a path, for path-building later
                 if member.type in ('instr-start', 'instr-toggle', 'instr-sensor', 'instr-control'):
-                    new_path = {}
-                    new_path['start_type'] = member.type
-                    new_path['start_pos'] = (member.x, member.y)
-                    new_path['start_dir'] = member.ARROW_DIRS[member.arrow_dir]
-                    new_path['color'] = member.color
-                    paths_to_process.append(new_path)
+                    paths_to_process.append((member.type,
+                                             member.x,
+                                             member.y,
+                                             DIRECTION_CODES[member.arrow_dir],
+                                             member.color))
 
                 # take note of any direction changes (arrow)
                 if member.type == 'instr-arrow':
-                    path[member.color][(member.x, member.y)]['dir_change'] = member.ARROW_DIRS[member.arrow_dir]
+                    dir_changes[member.color][cell] = DIRECTION_CODES[member.arrow_dir]
 
                 # set up the class to give to img and div tags, color unless it's a directional
                 if member.type == 'instr-arrow':
@@ -104,58 +293,51 @@ def process_solution(solution):
 
                 # if it's a fuser/splitter, we need to add the other half to the cell to the right as well
                 if member.type in ('feature-fuser', 'feature-splitter') and member.x < 9:
-                    cells[(member.x+1, member.y)].append((member.image_name.replace('.png', '2.png'), member_class))
+                    cells[cell+1].append((member.sprite_class+'2', member_class))
 
                 if member.type == 'instr-sensor':
-                    cells[(member.x, member.y)].append((member.image_name, member_class, member.element))
+                    cells[cell].append((member.sprite_class, member_class, member.element))
                 else:
-                    cells[(member.x, member.y)].append((member.image_name, member_class))
+                    cells[cell].append((member.sprite_class, member_class))
 
             # build the paths
-            OPPOSITE_SIDE = {"l": "r",
-                             "r": "l",
-                             "u": "d",
-                             "d": "u"}
-            while len(paths_to_process) > 0:
-                current_path = paths_to_process.pop(0)
-                current_pos = list(current_path['start_pos'])
+            for start_type, x, y, direction, path_color in paths_to_process:
+                edges = paths[path_color]
+                entered = entry_edges[path_color]
+                dir_change = dir_changes[path_color]
+
                 # arrows in the same cell as a start instruction override its direction
-                if current_path['start_type'] == 'instr-start':
-                    current_dir = path[current_path['color']][tuple(current_pos)]['dir_change'] or current_path['start_dir']
-                else:
-                    current_dir = current_path['start_dir']
-                path[current_path['color']][tuple(current_pos)]['edges'].add(current_dir)
+                cell = y * REACTOR_WIDTH + x
+                if start_type == 'instr-start' and dir_change[cell] != NO_DIRECTION:
+                    direction = dir_change[cell]
+                edges[cell] |= 1 << direction
                 while True:
                     # move position
-                    if current_dir == 'l':
-                        current_pos[0] -= 1
-                    elif current_dir == 'r':
-                        current_pos[0] += 1
-                    elif current_dir == 'u':
-                        current_pos[1] -= 1
-                    elif current_dir == 'd':
-                        current_pos[1] += 1
+                    x += DIRECTION_X[direction]
+                    y += DIRECTION_Y[direction]
 
                     # if we're now outside the graph, stop
-                    if not (0 <= current_pos[0] <= 9 and 0 <= current_pos[1] <= 7):
+                    if not (0 <= x < REACTOR_WIDTH and 0 <= y < REACTOR_HEIGHT):
                         break
+                    cell = y * REACTOR_WIDTH + x
 
                     # if we've already come into this cell from this direction, stop
-                    if OPPOSITE_SIDE[current_dir] in path[current_path['color']][tuple(current_pos)]['entry_edges']:
+                    entry_edge = 1 << OPPOSITE_DIRECTION[direction]
+                    if entered[cell] & entry_edge:
                         break
 
                     # otherwise, mark the incoming edge
-                    path[current_path['color']][tuple(current_pos)]['edges'].add(OPPOSITE_SIDE[current_dir])
-                    path[current_path['color']][tuple(current_pos)]['entry_edges'].add(OPPOSITE_SIDE[current_dir])
+                    edges[cell] |= entry_edge
+                    entered[cell] |= entry_edge
 
                     # determine if we're changing direction or going straight through
-                    if path[current_path['color']][tuple(current_pos)]['dir_change']:
-                        current_dir = path[current_path['color']][tuple(current_pos)]['dir_change']
+                    if dir_change[cell] != NO_DIRECTION:
+                        direction = dir_change[cell]
 
                     # mark outgoing edge
-                    path[current_path['color']][tuple(current_pos)]['edges'].add(current_dir)
+                    edges[cell] |= 1 << direction
 
-            reactors.append((cells, path, component.type))
+            reactors.append((cells, paths, component.type))
 
     return reactors
 
@@ -267,4 +449,6 @@ def process_overview(solution):
     for component in solution.level.fixedcomponents:
         add_component(cells, component.type, component.x, component.y)
 
-    return cells
+    # a plain dict, since the result is cached and shared between requests
+    # and looking up an empty cell in a defaultdict would add it
+    return dict(cells)
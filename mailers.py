@@ -0,0 +1,86 @@
+from cgi import escape
+from email.mime.text import MIMEText
+import os
+import smtplib
+import time
+
+from boto.ses import SESConnection
+
+
+class SESMailer(object):
+    """Sends through Amazon SES, keeping one connection for every email."""
+
+    def __init__(self, config):
+        self.config = config
+        self.connection = None
+
+    def send(self, from_address, to_address, subject, body):
+        if self.connection is None:
+            self.connection = SESConnection(aws_access_key_id=self.config['AWS_ACCESS_KEY_ID'],
+                                            aws_secret_access_key=self.config['AWS_SECRET_ACCESS_KEY'])
+        self.connection.send_email(from_address,
+                                   str(subject),
+                                   str(escape(body)),
+                                   str(to_address))
+
+    def close(self):
+        self.connection = None
+
+
+class SMTPMailer(object):
+    """Sends through an SMTP server, such as a local relay or a debugging
+    server (python -m smtpd -n -c DebuggingServer localhost:1025)."""
+
+    def __init__(self, server):
+        host, port = server.rsplit(':', 1)
+        self.host = host
+        self.port = int(port)
+        self.connection = None
+
+    def send(self, from_address, to_address, subject, body):
+        if self.connection is None:
+            self.connection = smtplib.SMTP(self.host, self.port)
+        message = MIMEText(body)
+        message['From'] = from_address
+        message['To'] = to_address
+        message['Subject'] = subject
+        self.connection.sendmail(from_address, [to_address], message.as_string())
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except smtplib.SMTPException:
+                pass
+        self.connection = None
+
+
+class FileMailer(object):
+    """Writes each email to a file in directory instead of sending it, for
+    development and testing."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def send(self, from_address, to_address, subject, body):
+        message = MIMEText(body)
+        message['From'] = from_address
+        message['To'] = to_address
+        message['Subject'] = subject
+        filename = os.path.join(self.directory, '{0:.6f}-{1}.eml'.format(time.time(), to_address))
+        output = open(filename, 'w')
+        output.write(message.as_string())
+        output.close()
+
+    def close(self):
+        pass
+
+
+def make_mailer(config):
+    """Returns the mailer named by the MAIL_BACKEND setting."""
+    backend = config.get('MAIL_BACKEND', 'ses')
+    if backend == 'smtp':
+        return SMTPMailer(config.get('SMTP_SERVER', 'localhost:25'))
+    elif backend == 'file':
+        return FileMailer(config['MAIL_FILE_DIR'])
+    return SESMailer(config)
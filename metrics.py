@@ -0,0 +1,222 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from passwords import LATENCY_BUCKETS
+
+
+# upper bounds of the buckets for request times (in seconds) and for the
+# number of SQL statements a request runs
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# a request that runs the same statement this many times is most likely
+# loading related rows one by one (N+1 queries), so it's logged and counted
+REPEATED_QUERY_THRESHOLD = 10
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Histogram(object):
+    """Counts observations into buckets with the given upper bounds, plus
+    one for anything larger. Not thread-safe on its own."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels=''):
+        """The histogram in the Prometheus text format, with cumulative
+        buckets. labels is a string like 'route="main_page"'."""
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            lines.append('{0}_bucket{{{1}le="{2}"}} {3}'.format(name, labels + ',' if labels else '', bound, total))
+        labels = '{' + labels + '}' if labels else ''
+        lines.append('{0}_sum{1} {2}'.format(name, labels, self.sum))
+        lines.append('{0}_count{1} {2}'.format(name, labels, self.count))
+        return lines
+
+
+class QueryCounter(object):
+    """The SQL statements run on this thread while the counter is active, see
+    Metrics.counting()."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = {}
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, threshold=REPEATED_QUERY_THRESHOLD):
+        """Returns the statements run at least threshold times, most often
+        run first, as (statement, times) pairs."""
+        return sorted(((statement, times) for statement, times in self.statements.items() if times >= threshold),
+                      key=lambda item: -item[1])
+
+
+class Metrics(object):
+    """Records how long each route takes and the SQL it runs, for the
+    /metrics page.
+
+    Statements are timed with SQLAlchemy's cursor execute events, and added
+    to every QueryCounter active on the thread that ran them: one for the
+    current request, and any opened with counting() or query_budget().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.routes = {}
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        event.listen(Engine, 'before_cursor_execute', self.before_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_execute)
+
+    def counters(self):
+        if not hasattr(self.local, 'counters'):
+            self.local.counters = []
+        return self.local.counters
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.started = time.time()
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.time() - getattr(self.local, 'started', time.time())
+        for counter in self.counters():
+            counter.add(statement, seconds)
+
+    @contextmanager
+    def counting(self):
+        """Counts the statements run in a with block on this thread."""
+        counter = QueryCounter()
+        self.counters().append(counter)
+        try:
+            yield counter
+        finally:
+            self.counters().remove(counter)
+
+    @contextmanager
+    def query_budget(self, max_queries):
+        """Raises QueryBudgetExceeded if a with block runs more than
+        max_queries statements, for tests to assert that a page's queries
+        don't grow with the number of rows it shows."""
+        with self.counting() as counter:
+            yield counter
+        if counter.count > max_queries:
+            raise QueryBudgetExceeded('{0} queries run, the budget was {1}:\n{2}'.format(
+                counter.count, max_queries,
+                '\n'.join('{0}x {1}'.format(times, statement)
+                          for statement, times in sorted(counter.statements.items(), key=lambda item: -item[1]))))
+
+    def start_request(self):
+        # a request that failed with an exception never reached
+        # finish_request, so its counter may still be here
+        self.local.counters = [counter for counter in self.counters()
+                               if counter is not getattr(self.local, 'request_counter', None)]
+        self.local.request_counter = QueryCounter()
+        self.local.request_started = time.time()
+        self.counters().append(self.local.request_counter)
+
+    def finish_request(self, response):
+        counter = getattr(self.local, 'request_counter', None)
+        if counter is None:
+            return response
+        self.counters().remove(counter)
+        self.local.request_counter = None
+        seconds = time.time() - self.local.request_started
+
+        route = request.endpoint or 'unmatched'
+        repeated = counter.repeated()
+        for statement, times in repeated:
+            self.app.logger.warning('{0} ran the same query {1} times: {2}'.format(route, times, statement))
+
+        with self.lock:
+            if route not in self.routes:
+                self.routes[route] = {'responses': {},
+                                      'seconds': Histogram(REQUEST_BUCKETS),
+                                      'queries': Histogram(QUERY_BUCKETS),
+                                      'sql_seconds': 0.0,
+                                      'repeated_queries': 0}
+            stats = self.routes[route]
+            stats['responses'][response.status_code] = stats['responses'].get(response.status_code, 0) + 1
+            stats['seconds'].observe(seconds)
+            stats['queries'].observe(counter.count)
+            stats['sql_seconds'] += counter.seconds
+            if repeated:
+                stats['repeated_queries'] += 1
+        return response
+
+    def render(self, password_metrics):
+        """Returns every metric in the Prometheus text format, including the
+        password hasher's (PasswordHasher.metrics())."""
+        lines = ['# HELP spacechem_requests_total Responses by route and status code.',
+                 '# TYPE spacechem_requests_total counter']
+        with self.lock:
+            routes = sorted(self.routes.items())
+            for route, stats in routes:
+                for status, count in sorted(stats['responses'].items()):
+                    lines.append('spacechem_requests_total{{route="{0}",status="{1}"}} {2}'.format(route, status,
+                                                                                                   count))
+
+            lines += ['# HELP spacechem_request_seconds Time taken to respond, by route.',
+                      '# TYPE spacechem_request_seconds histogram']
+            for route, stats in routes:
+                lines += stats['seconds'].lines('spacechem_request_seconds', 'route="{0}"'.format(route))
+
+            lines += ['# HELP spacechem_request_queries SQL statements run per request, by route.',
+                      '# TYPE spacechem_request_queries histogram']
+            for route, stats in routes:
+                lines += stats['queries'].lines('spacechem_request_queries', 'route="{0}"'.format(route))
+
+            lines += ['# HELP spacechem_sql_seconds_total Time spent running SQL statements, by route.',
+                      '# TYPE spacechem_sql_seconds_total counter']
+            for route, stats in routes:
+                lines.append('spacechem_sql_seconds_total{{route="{0}"}} {1}'.format(route, stats['sql_seconds']))
+
+            lines += ['# HELP spacechem_repeated_query_requests_total Requests that ran the same statement at '
+                      'least {0} times, by route.'.format(REPEATED_QUERY_THRESHOLD),
+                      '# TYPE spacechem_repeated_query_requests_total counter']
+            for route, stats in routes:
+                lines.append('spacechem_repeated_query_requests_total{{route="{0}"}} {1}'.format(
+                    route, stats['repeated_queries']))
+
+        hasher = Histogram(LATENCY_BUCKETS)
+        hasher.counts = password_metrics['latency_counts']
+        hasher.sum = password_metrics['hash_seconds']
+        hasher.count = password_metrics['hashes']
+        lines += ['# HELP spacechem_password_hash_seconds Time taken by each bcrypt hash.',
+                  '# TYPE spacechem_password_hash_seconds histogram']
+        lines += hasher.lines('spacechem_password_hash_seconds')
+        for name, kind, help in (('waiting', 'gauge', 'Password hashes waiting for a free slot.'),
+                                 ('running', 'gauge', 'Password hashes running.'),
+                                 ('max_waiting', 'gauge', 'Most password hashes ever waiting at once.'),
+                                 ('wait_seconds', 'counter', 'Time password hashes spent waiting for a slot.')):
+            metric = 'spacechem_password_hash_' + name + ('_total' if kind == 'counter' else '')
+            lines += ['# HELP {0} {1}'.format(metric, help),
+                      '# TYPE {0} {1}'.format(metric, kind),
+                      '{0} {1}'.format(metric, password_metrics[name])]
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,140 @@
+"""Brings the database's schema up to date with models.py.
+
+    python migrate.py [--status | --create]
+
+Each change to the schema is a numbered file in migrations/, applied in
+order and recorded in the schema_version table. Where a migration needs
+different SQL for a database there's a NNN_name.<dialect>.sql file beside
+NNN_name.sql, which is used instead. A database without a schema_version
+table is taken to have the schema the site started with, before 001.
+
+--create sets up an empty database with db.create_all() instead, and
+records every migration as applied since the models already include them.
+The rows that migrations add (such as the Pareto leaderboard) aren't part
+of the models, so those statements are still run.
+"""
+from optparse import OptionParser
+import os
+import re
+
+from sqlalchemy.sql.expression import text
+
+from models import db
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_PATTERN = re.compile(r'^(\d+)_([a-z0-9_]+)\.sql$')
+# statements that add rows of fixed data, rather than changing the schema
+DATA_PATTERN = re.compile(r'^INSERT INTO \w+ \([^)]*\) VALUES', re.IGNORECASE)
+
+
+def migrations(dialect):
+    """Returns the (version, name, path) of every migration, in order."""
+    found = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_PATTERN.match(filename)
+        if not match:
+            continue
+        version, name = int(match.group(1)), match.group(2)
+        path = os.path.join(MIGRATIONS_DIR, filename)
+        for_dialect = os.path.join(MIGRATIONS_DIR, '{0}_{1}.{2}.sql'.format(match.group(1), name, dialect))
+        if os.path.exists(for_dialect):
+            path = for_dialect
+        found.append((version, name, path))
+    return found
+
+
+def statements(path):
+    """Splits a migration into its statements, leaving out comments."""
+    lines = [line for line in open(path).read().splitlines() if not line.strip().startswith('--')]
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+
+def current_version(conn):
+    if not db.engine.dialect.has_table(conn, 'schema_version'):
+        return 0
+    return conn.execute('SELECT MAX(version) FROM schema_version').scalar() or 0
+
+
+def record_version(conn, version, name):
+    conn.execute(text('INSERT INTO schema_version (version, name) VALUES (:version, :name)'),
+                 version=version, name=name)
+
+
+def ensure_version_table(conn):
+    if not db.engine.dialect.has_table(conn, 'schema_version'):
+        conn.execute('CREATE TABLE schema_version (version INTEGER NOT NULL PRIMARY KEY, name VARCHAR(255))')
+
+
+def migrate():
+    """Applies each pending migration in its own transaction, returning the
+    names of those applied."""
+    applied = []
+    conn = db.engine.connect()
+    try:
+        version = current_version(conn)
+        for number, name, path in migrations(db.engine.dialect.name):
+            if number <= version:
+                continue
+            transaction = conn.begin()
+            try:
+                ensure_version_table(conn)
+                for statement in statements(path):
+                    conn.execute(statement)
+                record_version(conn, number, name)
+                transaction.commit()
+            except:
+                transaction.rollback()
+                raise
+            applied.append(name)
+    finally:
+        conn.close()
+    return applied
+
+
+def create():
+    db.create_all()
+    conn = db.engine.connect()
+    try:
+        transaction = conn.begin()
+        ensure_version_table(conn)
+        version = current_version(conn)
+        for number, name, path in migrations(db.engine.dialect.name):
+            if number > version:
+                for statement in statements(path):
+                    if DATA_PATTERN.match(statement):
+                        conn.execute(statement)
+                record_version(conn, number, name)
+        transaction.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = OptionParser(usage='%prog [--status | --create]')
+    parser.add_option('--status', action='store_true', default=False,
+                      help="list the migrations and whether they've been applied")
+    parser.add_option('--create', action='store_true', default=False,
+                      help='create the tables in an empty database and mark every migration applied')
+    options, args = parser.parse_args()
+
+    if options.status:
+        conn = db.engine.connect()
+        try:
+            version = current_version(conn)
+        finally:
+            conn.close()
+        for number, name, path in migrations(db.engine.dialect.name):
+            print('{0:03d} {1:<30} {2}'.format(number, name, 'applied' if number <= version else 'pending'))
+    elif options.create:
+        create()
+        print('Created the tables at schema version {0}'.format(migrations(db.engine.dialect.name)[-1][0]))
+    else:
+        applied = migrate()
+        for name in applied:
+            print('Applied ' + name)
+        print('Applied {0} migrations'.format(len(applied)))
+
+
+if __name__ == '__main__':
+    main()
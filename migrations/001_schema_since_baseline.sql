@@ -0,0 +1,47 @@
+-- the tables and columns added to models.py since the schema was first
+-- created with db.create_all()
+
+ALTER TABLE levels ADD COLUMN reactor_options VARCHAR(255) DEFAULT '';
+
+ALTER TABLE solutions ADD COLUMN content_hash VARCHAR(40);
+CREATE INDEX ix_solutions_content_hash ON solutions (content_hash);
+
+ALTER TABLE official_scores ADD COLUMN keyframe BOOLEAN;
+ALTER TABLE official_scores ADD COLUMN reactor_histogram BLOB;
+ALTER TABLE official_scores ADD COLUMN symbol_histogram BLOB;
+ALTER TABLE official_scores ADD COLUMN cycle_histogram BLOB;
+ALTER TABLE official_scores ADD COLUMN histogram_hash VARCHAR(40);
+ALTER TABLE official_scores ADD COLUMN chart_json TEXT;
+
+CREATE TABLE solution_renders (
+    solution_id INTEGER NOT NULL PRIMARY KEY REFERENCES solutions (solution_id),
+    version INTEGER,
+    data BLOB
+);
+
+CREATE TABLE user_ranks (
+    user_id INTEGER NOT NULL REFERENCES users (user_id),
+    level_id INTEGER NOT NULL REFERENCES levels (level_id),
+    leaderboard_id INTEGER NOT NULL REFERENCES leaderboards (leaderboard_id),
+    reactors INTEGER NOT NULL,
+    solution_id INTEGER REFERENCES solutions (solution_id),
+    rank INTEGER,
+    PRIMARY KEY (user_id, level_id, leaderboard_id, reactors)
+);
+
+CREATE TABLE versions (
+    name VARCHAR(255) NOT NULL PRIMARY KEY,
+    version INTEGER
+);
+
+CREATE TABLE outbox (
+    email_id INTEGER NOT NULL PRIMARY KEY,
+    to_address VARCHAR(255),
+    subject VARCHAR(255),
+    body TEXT,
+    status VARCHAR(10),
+    attempts INTEGER,
+    created TIMESTAMP,
+    next_attempt TIMESTAMP,
+    last_error VARCHAR(255)
+);
@@ -0,0 +1,21 @@
+-- indexes for the queries behind each page, see check_query_plans.py
+-- the two leaderboard order indexes only cover approved solutions here
+
+CREATE INDEX ix_solutions_level_approved_user ON solutions (level_id, approved, user_id);
+CREATE INDEX ix_solutions_user_approved ON solutions (user_id, approved);
+CREATE INDEX ix_solutions_approved_by_cycles
+    ON solutions (level_id, cycle_count, symbol_count, reactor_count, upload_time, solution_id)
+    WHERE approved;
+CREATE INDEX ix_solutions_approved_by_symbols
+    ON solutions (level_id, symbol_count, cycle_count, reactor_count, upload_time, solution_id)
+    WHERE approved;
+CREATE INDEX ix_solution_ranks_board ON solution_ranks (level_id, leaderboard_id, reactors, rank);
+CREATE INDEX ix_user_ranks_level_id ON user_ranks (level_id);
+CREATE INDEX ix_components_solution_id ON components (solution_id);
+CREATE INDEX ix_components_fixed_level_id ON components_fixed (level_id);
+CREATE INDEX ix_members_component_id ON members (component_id);
+CREATE INDEX ix_pipes_component_id ON pipes (component_id);
+CREATE INDEX ix_levels_slug ON levels (slug);
+CREATE INDEX ix_leaderboards_slug ON leaderboards (slug);
+CREATE INDEX ix_users_username ON users (username);
+CREATE INDEX ix_outbox_status_next_attempt ON outbox (status, next_attempt);
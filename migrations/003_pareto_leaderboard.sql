@@ -0,0 +1,6 @@
+-- the Pareto frontier leaderboard (PARETO_LEADERBOARD in models.py); each
+-- level's board is worked out in full the next time one of its solutions is
+-- added or removed (SolutionRank.rebuild_pareto), or run check_ranks.py
+-- afterwards to fill it in for every level at once
+
+INSERT INTO leaderboards (leaderboard_id, slug, description) VALUES (3, 'pareto', 'Pareto frontier');
@@ -0,0 +1,22 @@
+-- a user can have several solutions on a level's Pareto frontier board, so
+-- user_ranks is keyed by solution as well as by user; the table is copied
+-- since SQLite can't change a primary key in place
+
+CREATE TABLE user_ranks_new (
+    user_id INTEGER NOT NULL REFERENCES users (user_id),
+    level_id INTEGER NOT NULL REFERENCES levels (level_id),
+    leaderboard_id INTEGER NOT NULL REFERENCES leaderboards (leaderboard_id),
+    reactors INTEGER NOT NULL,
+    solution_id INTEGER NOT NULL REFERENCES solutions (solution_id),
+    rank INTEGER,
+    PRIMARY KEY (user_id, level_id, leaderboard_id, reactors, solution_id)
+);
+
+INSERT INTO user_ranks_new (user_id, level_id, leaderboard_id, reactors, solution_id, rank)
+    SELECT user_id, level_id, leaderboard_id, reactors, solution_id, rank FROM user_ranks;
+
+DROP TABLE user_ranks;
+
+ALTER TABLE user_ranks_new RENAME TO user_ranks;
+
+CREATE INDEX ix_user_ranks_level_id ON user_ranks (level_id);
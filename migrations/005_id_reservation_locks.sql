@@ -0,0 +1,6 @@
+-- the rows reserve_ids() in models.py locks on databases other than
+-- PostgreSQL, so that upload workers take turns reserving ids; created up
+-- front so that two workers can't both try to add them on their first upload
+
+INSERT INTO versions (name, version) VALUES ('ids:solutions', 0);
+INSERT INTO versions (name, version) VALUES ('ids:components', 0);
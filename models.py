@@ -1,13 +1,258 @@
-import bcrypt
+from collections import defaultdict, namedtuple
+from itertools import groupby
+import json
+from operator import attrgetter
 import sqlite3
+import time
+from weakref import WeakKeyDictionary
 
-from sqlalchemy import func, and_
-from sqlalchemy.orm import backref
+from sqlalchemy import event, func, and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, backref, contains_eager, joinedload, joinedload_all, subqueryload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.sql.expression import desc
+from sqlalchemy.sql.expression import desc, select
 
+from archives import MAX_SAVE_SIZE, save_database
 from forms import savefiles
-from spacechem import db
+from functions import (
+    apply_delta,
+    build_chart_data,
+    histogram_hash,
+    ordinal,
+    pack_delta,
+    pack_histogram,
+    pack_render,
+    parse_histogram,
+    process_overview,
+    process_solution,
+    read_savefile,
+    RENDER_VERSION,
+    solution_hash,
+    unpack_histogram,
+    unpack_render,
+)
+from skyline import Staircase, frontier, hidden_box, staircases
+from spacechem import db, page_cache, password_hasher, render_cache
+
+
+# SQLite's default limit on bind parameters in a single statement
+MAX_BIND_PARAMS = 999
+
+# how many levels or solutions to work through between progress reports
+PROGRESS_INTERVAL = 10
+
+# how many of a save's solutions are held in memory before they're written
+INSERT_BATCH_SIZE = 50
+
+class RankedBoard(namedtuple('RankedBoard', ['leaderboard_id', 'slug', 'title', 'sort_key', 'tiebreak',
+                                             'one_per_user'])):
+    """A leaderboard that ranks solutions in one order, best first: on the
+    solution columns in sort_key, then on tiebreak between solutions that
+    are equal on those. With one_per_user only each user's best solution is
+    ranked. title is what its pages call it."""
+    __slots__ = ()
+
+    @property
+    def order(self):
+        return self.sort_key + self.tiebreak
+
+
+TIEBREAK = ('upload_time', 'solution_id')
+
+# every board is ranked from its definition here, either in SQL (see
+# rank_statement()) or from the same read of a level's solutions (see
+# SolutionRank.calculate()), so adding one only needs its row in the
+# leaderboards table too
+RANKED_BOARDS = (RankedBoard(1, 'cycles', 'by least cycles', ('cycle_count', 'symbol_count', 'reactor_count'),
+                             TIEBREAK, True),
+                 RankedBoard(2, 'symbols', 'by least symbols', ('symbol_count', 'cycle_count', 'reactor_count'),
+                             TIEBREAK, True))
+RANKED_BOARDS_BY_ID = dict((board.leaderboard_id, board) for board in RANKED_BOARDS)
+RANKED_BOARDS_BY_SLUG = dict((board.slug, board) for board in RANKED_BOARDS)
+
+# the leaderboard of solutions on the Pareto frontier of cycles, symbols and
+# reactors, in this order; it isn't one sort order, so it's kept separately
+PARETO_LEADERBOARD = 3
+PARETO_ORDER = ('cycle_count', 'symbol_count', 'reactor_count') + TIEBREAK
+
+# how the leaderboard and profile pages show each board: its title, the
+# solution columns its table lists in order, the column its ranks are listed
+# under on profiles, what a place on it is called there (None for ordinal
+# ranks) and a description for its page
+BoardPage = namedtuple('BoardPage', ['leaderboard_id', 'slug', 'title', 'columns', 'profile_column', 'place_name',
+                                     'description'])
+BOARD_PAGES = tuple(BoardPage(board.leaderboard_id, board.slug, board.title, board.sort_key, board.sort_key[0],
+                              None, None)
+                    for board in RANKED_BOARDS) + (
+    BoardPage(PARETO_LEADERBOARD, 'pareto', 'Pareto frontier', PARETO_ORDER[:3], 'reactor_count', 'frontier',
+              'The solutions that no other solution matches or beats on cycles, symbols and reactors at once '
+              '(where several are identical, the first uploaded), in order of cycles.'),)
+BOARD_PAGES_BY_SLUG = dict((board.slug, board) for board in BOARD_PAGES)
+
+# the solution columns those pages list, with their headings
+SOLUTION_COLUMNS = (('cycle_count', 'Cycles'), ('symbol_count', 'Symbols'), ('reactor_count', 'Reactors'))
+
+# the solution columns that all of the boards are calculated from
+RANK_COLUMNS = tuple(sorted(set(('solution_id', 'user_id') + PARETO_ORDER
+                                + sum((board.order for board in RANKED_BOARDS), ()))))
+
+# copies a level's solution ranks into user_ranks, see UserRank
+COPY_USER_RANKS = ("INSERT INTO user_ranks (user_id, level_id, leaderboard_id, reactors, solution_id, rank) "
+                   "SELECT solutions.user_id, solution_ranks.level_id, solution_ranks.leaderboard_id, "
+                   "solution_ranks.reactors, solution_ranks.solution_id, solution_ranks.rank "
+                   "FROM solution_ranks JOIN solutions ON solutions.solution_id = solution_ranks.solution_id "
+                   "WHERE solution_ranks.level_id = :level_id")
+
+# level categories in the order they're listed, with their headings
+LEVEL_CATEGORIES = (('main', 'Main Game'),
+                    ('researchnet', 'ResearchNet Published'),
+                    ('tf2', 'TF2'),
+                    ('63corvi', '63 Corvi DLC'))
+
+# how many official score fetches are stored between full copies
+KEYFRAME_INTERVAL = 30
+
+# seconds between checks for a new version of the levels table
+LEVEL_REFRESH_INTERVAL = 10
+
+# the sprite class for members that have no image, which shows nothing
+UNKNOWN_SPRITE_CLASS = 'sprite-unknown'
+
+
+def reserve_ids(table, count):
+    """Reserves a block of count primary key values for table.
+
+    On PostgreSQL the values are drawn from the table's sequence in a single
+    statement. Other databases continue on from the current maximum, so the
+    caller must insert the rows in the same transaction; the table's row in
+    versions is locked first, until that transaction ends, so that upload
+    workers reserving at the same time take turns instead of getting the
+    same values.
+    """
+    if count == 0:
+        return []
+
+    column = list(table.primary_key)[0]
+    if db.engine.dialect.name == 'postgresql':
+        sequence = '{0}_{1}_seq'.format(table.name, column.name)
+        result = db.session.execute("SELECT nextval('{0}') FROM generate_series(1, :count)".format(sequence),
+                                    {'count': count})
+        return sorted(row[0] for row in result)
+
+    Version.bump('ids:' + table.name)
+    start = (db.session.execute(select([func.max(column)], for_update=True)).scalar() or 0) + 1
+    return range(start, start + count)
+
+
+# page cache versions waiting for the session that changed their pages to
+# commit; bumping them any earlier would let a request in between cache the
+# old page under the new version
+pending_bumps = WeakKeyDictionary()
+
+
+def bump_after_commit(name):
+    """Bumps a page cache version once the current transaction commits, or
+    not at all if it's rolled back."""
+    pending_bumps.setdefault(db.session(), set()).add(name)
+
+
+def bump_pending(session):
+    for name in pending_bumps.pop(session, ()):
+        page_cache.bump(name)
+
+
+def drop_pending(session):
+    pending_bumps.pop(session, None)
+
+
+event.listen(Session, 'after_commit', bump_pending)
+event.listen(Session, 'after_rollback', drop_pending)
+
+
+def sorts_before(columns, values):
+    """Returns a filter matching rows that sort strictly before values when
+    ordered by columns."""
+    clause = None
+    for column, value in reversed(zip(columns, values)):
+        if clause is None:
+            clause = column < value
+        else:
+            clause = or_(column < value, and_(column == value, clause))
+    return clause
+
+
+def supports_window_functions():
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return True
+    elif dialect == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 25, 0)
+    return False
+
+
+def rank_statement(board, outside_view):
+    """Builds an INSERT ... SELECT that ranks a level's approved solutions on
+    a RankedBoard, keeping only each user's best solution if the board is
+    one_per_user.
+
+    The "any reactors" board is always ranked, and for levels with an
+    outside view every reactor count is ranked as its own partition too.
+    Takes :level_id and :approved as parameters.
+    """
+    order_by = ', '.join(board.order)
+    columns = ', '.join(sorted(set(board.order) | set(['solution_id', 'level_id', 'user_id', 'reactor_count'])))
+
+    def ranks(reactors, partition, condition):
+        if board.one_per_user:
+            best = ("(SELECT {columns}, "
+                    "ROW_NUMBER() OVER (PARTITION BY user_id{user_partition} ORDER BY {order_by}) AS user_position "
+                    "FROM solutions "
+                    "WHERE level_id = :level_id AND approved = :approved{condition}) AS best "
+                    "WHERE user_position = 1").format(columns=columns,
+                                                      user_partition=', reactor_count' if partition else '',
+                                                      order_by=order_by,
+                                                      condition=condition)
+        else:
+            best = "solutions WHERE level_id = :level_id AND approved = :approved" + condition
+        return ("SELECT solution_id, {leaderboard_id}, level_id, {reactors}, "
+                "ROW_NUMBER() OVER ({partition}ORDER BY {order_by}) "
+                "FROM {best}").format(leaderboard_id=board.leaderboard_id,
+                                      reactors=reactors,
+                                      partition=partition,
+                                      order_by=order_by,
+                                      best=best)
+
+    statement = ("INSERT INTO solution_ranks (solution_id, leaderboard_id, level_id, reactors, rank) "
+                 + ranks('0', '', ''))
+    if outside_view:
+        statement += " UNION ALL " + ranks('reactor_count', 'PARTITION BY reactor_count ', ' AND reactor_count != 0')
+    return statement
+
+
+def bulk_insert(table, rows):
+    """Inserts rows (dicts that all have the same keys) into table, packing
+    as many rows into each INSERT statement as the bind parameter limit allows.
+    """
+    if not rows:
+        return
+
+    columns = sorted(rows[0].keys())
+    chunk_size = max(1, MAX_BIND_PARAMS // len(columns))
+    for start in range(0, len(rows), chunk_size):
+        params = {}
+        values = []
+        for i, row in enumerate(rows[start:start + chunk_size]):
+            names = []
+            for column in columns:
+                name = '{0}_{1}'.format(column, i)
+                params[name] = row[column]
+                names.append(':'+name)
+            values.append('('+', '.join(names)+')')
+        db.session.execute('INSERT INTO {0} ({1}) VALUES {2}'.format(table.name,
+                                                                    ', '.join(columns),
+                                                                    ', '.join(values)),
+                           params)
 
 
 class User(db.Model):
@@ -24,10 +269,46 @@ class User(db.Model):
         self.set_password(password)
 
     def set_password(self, password):
-        self.password = bcrypt.hashpw(password, bcrypt.gensalt())
+        self.password = password_hasher.hash(password)
 
     def check_password(self, password):
-        return bcrypt.hashpw(password, self.password) == self.password
+        """Checks a password, and if it's right but was hashed with an old
+        work factor, hashes it again with the current one. The caller is
+        responsible for committing."""
+        if not password_hasher.check(password, self.password):
+            return False
+        if password_hasher.needs_rehash(self.password):
+            self.set_password(password)
+        return True
+
+
+class OutgoingEmail(db.Model):
+    """An email waiting to be sent by send_outbox.py, or that has been."""
+    __tablename__ = 'outbox'
+
+    email_id = db.Column(db.Integer, primary_key=True)
+    to_address = db.Column(db.String(255))
+    subject = db.Column(db.String(255))
+    body = db.Column(db.Text)
+    # queued, sent or failed
+    status = db.Column(db.String(10), default='queued')
+    attempts = db.Column(db.Integer, default=0)
+    created = db.Column(db.DateTime, default=func.now())
+    next_attempt = db.Column(db.DateTime, default=func.now())
+    last_error = db.Column(db.String(255))
+
+    def __init__(self, to_address, subject, body):
+        self.to_address = to_address
+        self.subject = subject
+        self.body = body
+
+    @staticmethod
+    def due(now, limit):
+        return (OutgoingEmail.query
+                .filter(and_(OutgoingEmail.status == 'queued',
+                             OutgoingEmail.next_attempt <= now))
+                .order_by(OutgoingEmail.email_id)
+                .limit(limit))
 
 
 class Level(db.Model):
@@ -42,6 +323,100 @@ class Level(db.Model):
     order2 = db.Column(db.Integer)
     category = db.Column(db.String(255))
     outside_view = db.Column(db.Boolean, default=False)
+    # space-separated reactor counts that have their own leaderboards
+    reactor_options = db.Column(db.String(255), default='')
+
+    @property
+    def reactor_option_list(self):
+        return [int(reactors) for reactors in (self.reactor_options or '').split()]
+
+    @staticmethod
+    def update_reactor_options(level_id):
+        reactor_options = ' '.join(str(reactors) for (reactors,) in SolutionRank.reactor_counts(level_id))
+        changed = (Level.query
+                   .filter(and_(Level.level_id == level_id,
+                                or_(Level.reactor_options != reactor_options,
+                                    Level.reactor_options == None)))
+                   .update({'reactor_options': reactor_options}, synchronize_session=False))
+        if changed:
+            Version.bump('levels')
+
+
+class Version(db.Model):
+    """Counters for data that processes keep copies of, bumped whenever the
+    data changes so they know to load it again."""
+    __tablename__ = 'versions'
+
+    name = db.Column(db.String(255), primary_key=True)
+    version = db.Column(db.Integer, default=0)
+
+    @staticmethod
+    def get(name):
+        return db.session.query(Version.version).filter(Version.name == name).scalar() or 0
+
+    @staticmethod
+    def bump(name):
+        """Increments a version. The caller is responsible for committing."""
+        if not Version.query.filter(Version.name == name).update({'version': Version.version + 1},
+                                                                 synchronize_session=False):
+            db.session.add(Version(name=name, version=1))
+            db.session.flush()
+
+
+class LevelInfo(namedtuple('LevelInfo', ['level_id', 'name', 'internal_name', 'number', 'slug', 'order1',
+                                         'order2', 'category', 'outside_view', 'reactor_options'])):
+    """A read-only copy of a row of the levels table."""
+    __slots__ = ()
+
+    @property
+    def reactor_option_list(self):
+        return [int(reactors) for reactors in (self.reactor_options or '').split()]
+
+
+class LevelCatalog(object):
+    """Every level, indexed each way they're looked up. Never changed once
+    built, so it can be shared between threads."""
+
+    def __init__(self, version, levels):
+        self.version = version
+        self.levels = tuple(sorted(levels, key=lambda level: (level.category, level.order1, level.order2)))
+        self.by_id = dict((level.level_id, level) for level in self.levels)
+        self.by_slug = dict((level.slug, level) for level in self.levels)
+        self.by_internal_name = dict((level.internal_name, level) for level in self.levels)
+        by_category = defaultdict(list)
+        for level in self.levels:
+            by_category[level.category].append(level)
+        self.by_category = dict((category, tuple(levels)) for category, levels in by_category.items())
+
+    def in_category(self, category):
+        return self.by_category.get(category, ())
+
+
+class LevelRegistry(object):
+    """Keeps a LevelCatalog for the process, loading the levels table again
+    only when the 'levels' version has changed. The version is checked at
+    most once every LEVEL_REFRESH_INTERVAL seconds."""
+
+    def __init__(self):
+        self.catalog = None
+        self.checked = 0
+
+    def current(self):
+        now = time.time()
+        if self.catalog is None or now - self.checked > LEVEL_REFRESH_INTERVAL:
+            version = Version.get('levels')
+            if self.catalog is None or version != self.catalog.version:
+                rows = db.session.query(*[getattr(Level, field) for field in LevelInfo._fields])
+                self.catalog = LevelCatalog(version, [LevelInfo(*row) for row in rows])
+            self.checked = now
+        return self.catalog
+
+    def reload(self):
+        self.catalog = None
+        return self.current()
+
+
+level_registry = LevelRegistry()
 
 
 class OfficialScores(db.Model):
@@ -49,12 +424,149 @@ class OfficialScores(db.Model):
 
     level_id = db.Column(db.Integer, db.ForeignKey('levels.level_id'), primary_key=True)
     fetch_date = db.Column(db.Date, primary_key=True, default=func.now())
+    # older rows only have the histograms as strings, as they were fetched
     reactor_counts = db.Column(db.String(255))
     symbol_counts = db.Column(db.String(255))
     cycle_counts = db.Column(db.String(255))
+    # newer ones have them parsed and packed, along with the chart data for
+    # the stats page
+    # only keyframes hold the full histograms, the rows in between hold the
+    # changes since the previous fetch; older rows are all keyframes
+    # the chart data is kept on keyframes and on each level's newest row
+    keyframe = db.Column(db.Boolean)
+    reactor_histogram = db.Column(db.LargeBinary)
+    symbol_histogram = db.Column(db.LargeBinary)
+    cycle_histogram = db.Column(db.LargeBinary)
+    histogram_hash = db.Column(db.String(40))
+    chart_json = db.Column(db.Text)
 
     level = db.relationship('Level', backref='official_scores')
 
+    @property
+    def is_keyframe(self):
+        return self.keyframe is not False
+
+    def set_histograms(self, reactors, symbols, cycles, previous=None, fetches_since_keyframe=0):
+        """Stores the histograms (lists of ints).
+
+        If the previous fetch's histograms are given, only the changes from
+        them are stored, unless it's time for a new keyframe or the
+        histograms' buckets have changed. The chart data is worked out once
+        here so that the stats page doesn't have to; it's dropped from the
+        row again if it's a delta and a newer fetch comes in (see
+        clear_old_charts()).
+        """
+        histograms = (reactors, symbols, cycles)
+        if (previous is None or fetches_since_keyframe + 1 >= KEYFRAME_INTERVAL or
+                [len(counts) for counts in histograms] != [len(counts) for counts in previous]):
+            self.keyframe = True
+            packed = [pack_histogram(counts) for counts in histograms]
+        else:
+            self.keyframe = False
+            packed = [pack_delta(counts, previous_counts)
+                      for counts, previous_counts in zip(histograms, previous)]
+
+        self.reactor_histogram, self.symbol_histogram, self.cycle_histogram = packed
+        self.histogram_hash = histogram_hash(reactors, symbols, cycles)
+        self.chart_json = json.dumps(build_chart_data(reactors, symbols, cycles))
+
+    def histograms(self, previous=None):
+        """Returns the (reactors, symbols, cycles) histograms as lists of ints.
+        Rows that aren't keyframes need the previous fetch's histograms."""
+        if not self.is_keyframe:
+            return tuple(apply_delta(previous_counts, data)
+                         for previous_counts, data in zip(previous, (self.reactor_histogram,
+                                                                     self.symbol_histogram,
+                                                                     self.cycle_histogram)))
+        if self.cycle_histogram is not None:
+            return (unpack_histogram(self.reactor_histogram),
+                    unpack_histogram(self.symbol_histogram),
+                    unpack_histogram(self.cycle_histogram))
+        return (parse_histogram(self.reactor_counts),
+                parse_histogram(self.symbol_counts),
+                parse_histogram(self.cycle_counts))
+
+    def chart_data(self):
+        if self.chart_json is not None:
+            return json.loads(self.chart_json)
+        return build_chart_data(*self.histograms())
+
+    @staticmethod
+    def newest(level_id):
+        return (OfficialScores.query
+                .filter(OfficialScores.level_id == level_id)
+                .order_by(desc(OfficialScores.fetch_date))
+                .limit(1))
+
+    @staticmethod
+    def clear_old_charts(level_ids, before):
+        """Drops the chart data from the rows fetched before the given date
+        that aren't keyframes, once newer rows have their own. The caller is
+        responsible for committing."""
+        chunk_size = MAX_BIND_PARAMS - 1
+        for start in range(0, len(level_ids), chunk_size):
+            (OfficialScores.query
+             .filter(and_(OfficialScores.level_id.in_(level_ids[start:start + chunk_size]),
+                          OfficialScores.fetch_date < before,
+                          OfficialScores.keyframe == False,
+                          OfficialScores.chart_json != None))
+             .update({'chart_json': None}, synchronize_session=False))
+
+    @staticmethod
+    def replay(rows):
+        """Yields (scores, histograms) for a level's rows, given in date order
+        starting from a keyframe."""
+        histograms = None
+        for scores in rows:
+            histograms = scores.histograms(histograms)
+            yield scores, histograms
+
+    @staticmethod
+    def history(level_id):
+        rows = (OfficialScores.query
+                .filter(OfficialScores.level_id == level_id)
+                .order_by(OfficialScores.fetch_date))
+        return OfficialScores.replay(rows)
+
+    @staticmethod
+    def since_keyframe(level_ids, before=None):
+        """Returns a query for each level's rows from its last keyframe on
+        (before the given date, if any), in level and date order."""
+        # the level ids are only bound once, in the keyframe subquery; the
+        # join limits the rows to those levels
+        conditions = []
+        if before is not None:
+            conditions.append(OfficialScores.fetch_date < before)
+        is_keyframe = or_(OfficialScores.keyframe == True, OfficialScores.keyframe == None)
+        keyframes = (db.session.query(OfficialScores.level_id,
+                                      func.max(OfficialScores.fetch_date).label('fetch_date'))
+                     .filter(and_(is_keyframe, OfficialScores.level_id.in_(level_ids), *conditions))
+                     .group_by(OfficialScores.level_id)
+                     .subquery())
+        rows = (OfficialScores.query
+                .join((keyframes, and_(OfficialScores.level_id == keyframes.c.level_id,
+                                       OfficialScores.fetch_date >= keyframes.c.fetch_date)))
+                .order_by(OfficialScores.level_id, OfficialScores.fetch_date))
+        if before is not None:
+            rows = rows.filter(OfficialScores.fetch_date < before)
+        return rows
+
+    @staticmethod
+    def latest(level_ids, before=None):
+        """Returns {level_id: (scores, histograms, fetches_since_keyframe)}
+        for the last scores stored for each level (before the given date, if
+        any), reading only the rows from each level's last keyframe on."""
+        level_ids = list(level_ids)
+        chunk_size = MAX_BIND_PARAMS - 1
+        latest = dict()
+        for start in range(0, len(level_ids), chunk_size):
+            rows = OfficialScores.since_keyframe(level_ids[start:start + chunk_size], before)
+            for level_id, level_rows in groupby(rows, attrgetter('level_id')):
+                for fetches, (scores, histograms) in enumerate(OfficialScores.replay(level_rows)):
+                    pass
+                latest[level_id] = (scores, histograms, fetches)
+        return latest
+
 
 class SaveFile(db.Model):
     __tablename__ = 'savefiles'
@@ -68,90 +580,140 @@ class SaveFile(db.Model):
     def __init__(self, user_id):
         self.user_id = user_id
 
-    def process(self, approve_all=True):
+    def process(self, filename, approve_all=True, progress=None, max_size=MAX_SAVE_SIZE):
+        """Uploads every new solution in the save, stored in the savefiles
+        upload set as filename (a .user file, or a .zip or .gz of one),
+        returning the number of solutions uploaded and skipped as duplicates.
+
+        If given, progress is called with levels_parsed, solutions_inserted
+        and ranks_refreshed counts as the save is worked through.
+        """
+        if progress is None:
+            progress = lambda **counts: None
+
         approve_all = bool(approve_all)
-        user = User.query.filter_by(user_id=self.user_id).one()
-        filename = savefiles.path(user.username+'-'+str(self.file_id)+'.user')
-        conn = sqlite3.connect(filename)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
 
-        uploaded = 0
+        levels_parsed = 0
         skipped = 0
-        recalc_levels = set()
-
-        levels = Level.query.all()
-        for level in levels:
-            c.execute("SELECT * FROM Level WHERE id = ? AND passed = 1", (level.internal_name,))
-            level_row = c.fetchone()
-            if level_row:
-                # check if a solution with the same statistics already exists
-                # if it does, this is (probably?) a duplicate
-                try:
-                    existing_solution = (Solution.query
-                                         .filter(and_(Solution.level_id == level.level_id,
-                                                      Solution.user_id == self.user_id,
-                                                      Solution.cycle_count == level_row['cycles'],
-                                                      Solution.symbol_count == level_row['symbols'],
-                                                      Solution.reactor_count == level_row['reactors']))
-                                         .one())
+        new_solutions = []
+        solution_ids = []
+
+        # load everything the user has uploaded before in one go, so that
+        # duplicates can be spotted without a query per level
+        # older solutions have no hash, those are matched on their statistics
+        existing_hashes = set()
+        existing_stats = set()
+        for content_hash, level_id, cycles, symbols, reactors in Solution.previous_uploads(self.user_id):
+            if content_hash:
+                existing_hashes.add(content_hash)
+            else:
+                existing_stats.add((level_id, cycles, symbols, reactors))
+
+        # new solutions are written in batches as they're read, so only a
+        # batch of them is held in memory however big the save is
+        levels = level_registry.current().by_internal_name
+        with save_database(savefiles.path(filename), max_size) as conn:
+            for levels_parsed, (level_name, level_row, components) in enumerate(read_savefile(conn, levels), 1):
+                if levels_parsed % PROGRESS_INTERVAL == 0:
+                    progress(levels_parsed=levels_parsed)
+
+                level_id = levels[level_name].level_id
+                content_hash = solution_hash(level_id, components)
+                stats = (level_id, level_row['cycles'], level_row['symbols'], level_row['reactors'])
+                if content_hash in existing_hashes or stats in existing_stats:
                     skipped += 1
                     continue
-                except NoResultFound:
-                    uploaded += 1
-                    recalc_levels.add(level.level_id)
-
-                solution = Solution(self.file_id,
-                                    self.user_id,
-                                    level.level_id,
-                                    level_row['cycles'],
-                                    level_row['symbols'],
-                                    level_row['reactors'],
-                                    approve_all)
-                db.session.add(solution)
-                db.session.commit()
-
-                c.execute("SELECT * FROM Component WHERE level_id = ?", (level.internal_name,))
-                component_rows = c.fetchall()
-                for component_row in component_rows:
-                    component = Component(solution.solution_id,
-                                          component_row['type'],
-                                          component_row['x'],
-                                          component_row['y'])
-                    db.session.add(component)
-                    db.session.commit()
-
-                    c.execute("SELECT * FROM Member WHERE component_id = ?", (component_row['rowid'],))
-                    member_rows = c.fetchall()
-                    for member_row in member_rows:
-                        member = Member(component.component_id,
-                                        member_row['type'],
-                                        member_row['arrow_dir'],
-                                        member_row['choice'],
-                                        member_row['layer'],
-                                        member_row['x'],
-                                        member_row['y'],
-                                        member_row['element_type'],
-                                        member_row['element'])
-                        db.session.add(member)
-
-                    c.execute("SELECT * FROM Pipe WHERE component_id = ?", (component_row['rowid'],))
-                    pipe_rows = c.fetchall()
-                    for pipe_row in pipe_rows:
-                        pipe = Pipe(component.component_id,
-                                    pipe_row['output_id'],
-                                    pipe_row['x'],
-                                    pipe_row['y'])
-                        db.session.add(pipe)
-
-                    db.session.commit()
-
-        # recalculate the ranks if everything is auto-approved
-        if approve_all:
-            for level_id in recalc_levels:
-                SolutionRank.recalculate(level_id)
-
-        return (uploaded, skipped)
+
+                new_solutions.append((level_id, level_row, components, content_hash))
+                if len(new_solutions) >= INSERT_BATCH_SIZE:
+                    solution_ids += self.insert_solutions(new_solutions, approve_all)
+                    new_solutions = []
+                    progress(solutions_inserted=len(solution_ids))
+
+        progress(levels_parsed=levels_parsed)
+
+        solution_ids += self.insert_solutions(new_solutions, approve_all)
+        progress(solutions_inserted=len(solution_ids))
+
+        # rank the new solutions if everything is auto-approved, in the same
+        # transaction as they were written: if anything fails the whole save
+        # is rolled back, rather than a retry skipping solutions that were
+        # stored but never ranked as duplicates
+        if approve_all and solution_ids:
+            solutions = Solution.query.filter(Solution.solution_id.in_(solution_ids)).all()
+            for ranks_refreshed, solution in enumerate(solutions, 1):
+                SolutionRank.insert_solution(solution)
+                if ranks_refreshed % PROGRESS_INTERVAL == 0:
+                    progress(ranks_refreshed=ranks_refreshed)
+            progress(ranks_refreshed=len(solutions))
+        db.session.commit()
+
+        return (len(solution_ids), skipped)
+
+    def insert_solutions(self, new_solutions, approved):
+        """Writes a batch of a save's solutions. The caller is responsible
+        for committing.
+
+        new_solutions is a list of (level_id, level_row, components,
+        content_hash) tuples, where components is a list of
+        (component_row, member_rows, pipe_rows).
+        Solution and component ids are reserved up front so that every table
+        can be written with a handful of multi-row INSERTs. Returns the ids
+        of the new solutions.
+        """
+        if not new_solutions:
+            return []
+
+        upload_time = db.session.execute(select([func.now()])).scalar()
+        num_components = sum(len(components) for (level_id, level_row, components, content_hash) in new_solutions)
+        solution_ids = reserve_ids(Solution.__table__, len(new_solutions))
+        component_ids = iter(reserve_ids(Component.__table__, num_components))
+
+        solution_rows = []
+        component_rows = []
+        member_rows = []
+        pipe_rows = []
+        for solution_id, (level_id, level_row, components, content_hash) in zip(solution_ids, new_solutions):
+            solution_rows.append({'solution_id': solution_id,
+                                  'file_id': self.file_id,
+                                  'user_id': self.user_id,
+                                  'level_id': level_id,
+                                  'cycle_count': level_row['cycles'],
+                                  'symbol_count': level_row['symbols'],
+                                  'reactor_count': level_row['reactors'],
+                                  'upload_time': upload_time,
+                                  'approved': approved,
+                                  'content_hash': content_hash})
+
+            for component_row, member_rows_in, pipe_rows_in in components:
+                component_id = next(component_ids)
+                component_rows.append({'component_id': component_id,
+                                       'solution_id': solution_id,
+                                       'type': component_row['type'],
+                                       'x': component_row['x'],
+                                       'y': component_row['y']})
+                for member_row in member_rows_in:
+                    member_rows.append({'component_id': component_id,
+                                        'type': member_row['type'],
+                                        'arrow_dir': member_row['arrow_dir'],
+                                        'choice': member_row['choice'],
+                                        'layer': member_row['layer'],
+                                        'x': member_row['x'],
+                                        'y': member_row['y'],
+                                        'element_type': member_row['element_type'],
+                                        'element': member_row['element']})
+                for pipe_row in pipe_rows_in:
+                    pipe_rows.append({'component_id': component_id,
+                                      'output_id': pipe_row['output_id'],
+                                      'x': pipe_row['x'],
+                                      'y': pipe_row['y']})
+
+        bulk_insert(Solution.__table__, solution_rows)
+        bulk_insert(Component.__table__, component_rows)
+        bulk_insert(Member.__table__, member_rows)
+        bulk_insert(Pipe.__table__, pipe_rows)
+
+        return solution_ids
 
 
 class Leaderboard(db.Model):
@@ -176,6 +738,7 @@ class Solution(db.Model):
     description = db.Column(db.String(255))
     youtube = db.Column(db.String(255))
     approved = db.Column(db.Boolean, default=True)
+    content_hash = db.Column(db.String(40), index=True)
 
     savefile = db.relationship('SaveFile', backref='solutions')
     user = db.relationship('User', backref='solutions')
@@ -190,6 +753,90 @@ class Solution(db.Model):
         self.reactor_count = reactor_count
         self.approved = approved
 
+    @staticmethod
+    def with_details(solution_id):
+        """Returns a query for a solution, along with the level, user and
+        ranks its page shows."""
+        return (Solution.query
+                .options(joinedload('level'), joinedload('user'), joinedload_all('ranks.leaderboard'))
+                .filter(Solution.solution_id == solution_id))
+
+    @staticmethod
+    def for_user_page(user_id):
+        """Returns a query for a user's approved solutions with their levels,
+        in level order."""
+        return (Solution.query
+                .join(Solution.level)
+                .options(contains_eager(Solution.level))
+                .filter(and_(Solution.user_id == user_id,
+                             Solution.approved == True))
+                .order_by(Level.order1, Level.order2))
+
+    @staticmethod
+    def unapproved_for_user(user_id):
+        return (Solution.query
+                .filter(and_(Solution.user_id == user_id,
+                             Solution.approved == False)))
+
+    @staticmethod
+    def previous_uploads(user_id):
+        """Returns a query for what's needed to spot a user's duplicate
+        uploads: (content_hash, level_id, cycles, symbols, reactors)."""
+        return (db.session.query(Solution.content_hash,
+                                 Solution.level_id,
+                                 Solution.cycle_count,
+                                 Solution.symbol_count,
+                                 Solution.reactor_count)
+                .filter(Solution.user_id == user_id))
+
+    def render_model(self):
+        """Returns the (reactors, overview) that the solution page is drawn
+        from. Solutions never change once uploaded, so this is only worked out
+        on the first view, and is then kept in the database and in each
+        worker's render_cache."""
+        model = render_cache.get(self.solution_id)
+        if model is not None:
+            return model
+
+        render = SolutionRender.query.get(self.solution_id)
+        if render and render.version == RENDER_VERSION:
+            model = unpack_render(render.data)
+        else:
+            # members and pipes are loaded for every component at once,
+            # rather than one component at a time as they are drawn
+            set_committed_value(self, 'components', Component.for_solution(self.solution_id).all())
+            model = (process_solution(self), process_overview(self))
+            # written outside the request's session, so nothing else pending
+            # in it is committed by a page view
+            table = SolutionRender.__table__
+            values = {'version': RENDER_VERSION, 'data': pack_render(model)}
+            if render:
+                db.engine.execute(table.update().where(table.c.solution_id == self.solution_id), **values)
+            else:
+                try:
+                    db.engine.execute(table.insert(), solution_id=self.solution_id, **values)
+                except IntegrityError:
+                    # another worker stored it first
+                    pass
+
+        render_cache.set(self.solution_id, model)
+        return model
+
+
+class SolutionRender(db.Model):
+    __tablename__ = 'solution_renders'
+
+    solution_id = db.Column(db.Integer, db.ForeignKey('solutions.solution_id'), primary_key=True)
+    version = db.Column(db.Integer)
+    data = db.Column(db.LargeBinary)
+
+    solution = db.relationship('Solution', backref=db.backref('render', uselist=False, cascade='save-update, merge, delete'))
+
+    def __init__(self, solution_id, version, data):
+        self.solution_id = solution_id
+        self.version = version
+        self.data = data
+
 
 class SolutionRank(db.Model):
     __tablename__ = 'solution_ranks'
@@ -212,115 +859,469 @@ class SolutionRank(db.Model):
     
     @property
     def rank_str(self):
-        if self.rank % 10 == 1 and self.rank % 100 != 11:
-            return str(self.rank) + 'st'
-        elif self.rank % 10 == 2 and self.rank % 100 != 12:
-            return str(self.rank) + 'nd'
-        elif self.rank % 10 == 3 and self.rank % 100 != 13:
-            return str(self.rank) + 'rd'
-        else:
-            return str(self.rank) + 'th'
+        return ordinal(self.rank)
     
+    @staticmethod
+    def ranked_solutions(level_id):
+        """Returns a query for the columns of a level's approved solutions
+        that every board is ranked on (RANK_COLUMNS), as tuples."""
+        return (db.session.query(*[getattr(Solution, name) for name in RANK_COLUMNS])
+                .filter(and_(Solution.level_id == level_id,
+                             Solution.approved == True)))
+
+    @staticmethod
+    def calculate(level_id):
+        """Returns the full set of ranks for a level, as (solution_id,
+        leaderboard_id, reactors, rank) tuples, without touching the stored
+        ranks. The level's solutions are read once and every board is
+        worked out from them."""
+        outside_view = level_registry.current().by_id[level_id].outside_view
+        solutions = SolutionRank.ranked_solutions(level_id).all()
+        ranks = set()
+        for board in RANKED_BOARDS:
+            ranks |= SolutionRank.rank_board(board, solutions, outside_view)
+        return ranks | SolutionRank.calculate_pareto(solutions, outside_view)
+
+    @staticmethod
+    def calculate_pareto(solutions, outside_view):
+        """Returns the Pareto leaderboard's ranks for solutions, as
+        (solution_id, leaderboard_id, reactors, rank) tuples."""
+        keys = [SolutionRank.pareto_key(solution) for solution in solutions]
+        return SolutionRank.pareto_ranks(staircases(keys, SolutionRank.pareto_bucket(outside_view)), outside_view)
+
+    @staticmethod
+    def rank_board(board, solutions, outside_view):
+        """Ranks solutions on a RankedBoard, returning (solution_id,
+        leaderboard_id, reactors, rank) tuples. The "any reactors" board and
+        each reactor count's board are all filled in one pass over the
+        sorted solutions."""
+        ranks = set()
+        next_rank = defaultdict(lambda: 1)
+        users = defaultdict(set)
+        for solution in sorted(solutions, key=attrgetter(*board.order)):
+            for reactors in SolutionRank.reactor_boards(solution.reactor_count, outside_view):
+                if board.one_per_user:
+                    if solution.user_id in users[reactors]:
+                        continue
+                    users[reactors].add(solution.user_id)
+                ranks.add((solution.solution_id, board.leaderboard_id, reactors, next_rank[reactors]))
+                next_rank[reactors] += 1
+        return ranks
+
     @staticmethod
     def recalculate(level_id):
+        """Rebuilds every leaderboard for a level from scratch.
+
+        Where the database supports window functions each RankedBoard is
+        ranked and inserted entirely in SQL, and only the Pareto board, which
+        isn't one sort order, is calculated in Python. Otherwise every board
+        is calculated in Python, as SolutionRank.verify() does.
+        """
         SolutionRank.query.filter(SolutionRank.level_id == level_id).delete()
-        
-        # cycles
-        # first do the "any reactors" leaderboard
-        users = set()
-        rank = 1
-
-        solutions = (Solution.query
-                     .filter(and_(Solution.level_id == level_id,
-                                  Solution.approved==True))
-                     .order_by('cycle_count',
-                               'symbol_count',
-                               'reactor_count',
-                               'upload_time')
-                     .all())
-        for solution in solutions:
-            if solution.user_id not in users:
-                users.add(solution.user_id)
-                solution_rank = SolutionRank(solution.solution_id, 1, solution.level_id, rank)
-                db.session.add(solution_rank)
-                rank += 1
-
-        # then any individual reactor counts if necessary
-        if solution.level.outside_view:
-            reactor_options = (db.session.query(Solution.reactor_count)
-                               .filter(and_(Solution.level_id == level_id,
-                                            Solution.reactor_count != 0,
-                                            Solution.approved == True))
-                               .distinct()
-                               .order_by(Solution.reactor_count)
-                               .all())
-            for reactor_count in reactor_options:
-                users = set()
-                rank = 1
-
-                solutions = (Solution.query
-                             .filter(and_(Solution.level_id == level_id,
-                                          Solution.reactor_count == reactor_count[0],
-                                          Solution.approved==True))
-                             .order_by('cycle_count',
-                                       'symbol_count',
-                                       'upload_time')
-                             .all())
-                for solution in solutions:
-                    if solution.user_id not in users:
-                        users.add(solution.user_id)
-                        solution_rank = SolutionRank(solution.solution_id, 1, solution.level_id, rank, reactor_count[0])
-                        db.session.add(solution_rank)
-                        rank += 1
-
-        # symbols
-        # first do the "any reactors" leaderboard
-        users = set()
-        rank = 1
-
-        solutions = (Solution.query
-                     .filter(and_(Solution.level_id == level_id,
-                                  Solution.approved==True))
-                     .order_by('symbol_count',
-                               'cycle_count',
-                               'reactor_count',
-                               'upload_time')
-                     .all())
-        for solution in solutions:
-            if solution.user_id not in users:
-                users.add(solution.user_id)
-                solution_rank = SolutionRank(solution.solution_id, 2, solution.level_id, rank)
-                db.session.add(solution_rank)
-                rank += 1
-
-        # then any individual reactor counts if necessary
-        if solution.level.outside_view:
-            reactor_options = (db.session.query(Solution.reactor_count)
-                               .filter(and_(Solution.level_id == level_id,
-                                            Solution.reactor_count != 0))
-                               .distinct()
-                               .order_by(Solution.reactor_count)
-                               .all())
-            for reactor_count in reactor_options:
-                users = set()
-                rank = 1
-
-                solutions = (Solution.query
-                             .filter(and_(Solution.level_id == level_id,
-                                          Solution.reactor_count == reactor_count[0],
-                                          Solution.approved == True))
-                             .order_by('symbol_count',
-                                       'cycle_count',
-                                       'upload_time')
-                             .all())
-                for solution in solutions:
-                    if solution.user_id not in users:
-                        users.add(solution.user_id)
-                        solution_rank = SolutionRank(solution.solution_id, 2, solution.level_id, rank, reactor_count[0])
-                        db.session.add(solution_rank)
-                        rank += 1
+        if supports_window_functions():
+            outside_view = level_registry.current().by_id[level_id].outside_view
+            for board in RANKED_BOARDS:
+                db.session.execute(rank_statement(board, outside_view),
+                                   {'level_id': level_id, 'approved': True})
+            ranks = SolutionRank.calculate_pareto(SolutionRank.ranked_solutions(level_id).all(), outside_view)
+        else:
+            ranks = SolutionRank.calculate(level_id)
+        bulk_insert(SolutionRank.__table__, [{'solution_id': solution_id,
+                                              'leaderboard_id': leaderboard_id,
+                                              'level_id': level_id,
+                                              'reactors': reactors,
+                                              'rank': rank}
+                                             for solution_id, leaderboard_id, reactors, rank in ranks])
+        SolutionRank.ranks_changed(level_id)
         db.session.commit()
 
+    @staticmethod
+    def ranks_changed(level_id, changed=None):
+        """Refreshes everything that is derived from a level's ranks. changed
+        is the set of (solution_id, leaderboard_id, reactors) keys of the rank
+        rows that were added, moved or removed; without it every row of the
+        level is copied again."""
+        db.session.flush()
+        Level.update_reactor_options(level_id)
+        if changed is None:
+            UserRank.update_level(level_id)
+        else:
+            UserRank.update_rows(level_id, changed)
+        slug = level_registry.current().by_id[level_id].slug
+        # the database's copy is what the API's ETags come from, since the
+        # page cache's versions may only live in this process
+        Version.bump('level:' + slug)
+        bump_after_commit('level:' + slug)
+
+    @staticmethod
+    def verify(level_id):
+        """Checks the stored ranks for a level against a full recalculation."""
+        stored = (db.session.query(SolutionRank.solution_id,
+                                   SolutionRank.leaderboard_id,
+                                   SolutionRank.reactors,
+                                   SolutionRank.rank)
+                  .filter(SolutionRank.level_id == level_id))
+        return set(tuple(row) for row in stored) == SolutionRank.calculate(level_id)
+
+    @staticmethod
+    def board(leaderboard_id, level_id, reactors):
+        return (SolutionRank.query
+                .filter(and_(SolutionRank.leaderboard_id == leaderboard_id,
+                             SolutionRank.level_id == level_id,
+                             SolutionRank.reactors == reactors)))
+
+    @staticmethod
+    def entries(leaderboard_id, level_id, reactors):
+        """A board joined to its solutions, to filter on their columns."""
+        return SolutionRank.board(leaderboard_id, level_id, reactors).join(SolutionRank.solution)
+
+    @staticmethod
+    def page(leaderboard_id, level_id, reactors, after, limit):
+        """Returns a query for up to limit entries on a board ranked below
+        after, with their solutions and users."""
+        return (SolutionRank.board(leaderboard_id, level_id, reactors)
+                .options(joinedload_all('solution.user'))
+                .filter(SolutionRank.rank > after)
+                .order_by(SolutionRank.rank)
+                .limit(limit))
+
+    @staticmethod
+    def best(leaderboard_id, level_id):
+        return SolutionRank.board(leaderboard_id, level_id, 0).filter(SolutionRank.rank == 1)
+
+    @staticmethod
+    def reactor_counts(level_id):
+        """Returns a query for the reactor counts a level has boards for."""
+        return (db.session.query(SolutionRank.reactors)
+                .filter(and_(SolutionRank.level_id == level_id,
+                             SolutionRank.reactors != 0))
+                .distinct()
+                .order_by(SolutionRank.reactors))
+
+    @staticmethod
+    def runner_up(solution, ranked_board, reactors):
+        """Returns a query for the user's next best solution on a board,
+        after the given one."""
+        runner_up = (Solution.query
+                     .filter(and_(Solution.level_id == solution.level_id,
+                                  Solution.user_id == solution.user_id,
+                                  Solution.approved == True,
+                                  Solution.solution_id != solution.solution_id)))
+        if reactors:
+            runner_up = runner_up.filter(Solution.reactor_count == reactors)
+        return runner_up.order_by(*[getattr(Solution, name) for name in ranked_board.order]).limit(1)
+
+    @staticmethod
+    def row_keys(query):
+        """Returns the (solution_id, leaderboard_id, reactors) keys of the rows
+        a SolutionRank query matches."""
+        return set(tuple(row) for row in query.values(SolutionRank.solution_id,
+                                                      SolutionRank.leaderboard_id,
+                                                      SolutionRank.reactors))
+
+    @staticmethod
+    def reactor_boards(reactor_count, outside_view):
+        """Returns the reactors values of the boards a solution with
+        reactor_count reactors is ranked on: the "any reactors" board, and
+        its own reactor count's on levels with an outside view."""
+        if outside_view and reactor_count != 0:
+            return (0, reactor_count)
+        return (0,)
+
+    @staticmethod
+    def boards(solution):
+        """Returns the (leaderboard_id, reactors) boards a solution competes on."""
+        outside_view = level_registry.current().by_id[solution.level_id].outside_view
+        return [(board.leaderboard_id, reactors)
+                for board in RANKED_BOARDS
+                for reactors in SolutionRank.reactor_boards(solution.reactor_count, outside_view)]
+
+    @staticmethod
+    def insert_solution(solution):
+        """Ranks a newly approved solution on each of its boards, only moving
+        the entries between its new rank and its user's previous entry. The
+        caller is responsible for committing."""
+        changed = set()
+        for leaderboard_id, reactors in SolutionRank.boards(solution):
+            changed |= SolutionRank.place(solution, leaderboard_id, reactors)
+        changed |= SolutionRank.insert_pareto(solution)
+        SolutionRank.ranks_changed(solution.level_id, changed)
+
+    @staticmethod
+    def remove_solution(solution):
+        """Takes a solution off its boards before it's deleted, closing the gap
+        it leaves and moving its user's next best solution (if any) up into
+        the board. The caller is responsible for committing."""
+        solution_ranks = (SolutionRank.query
+                          .filter(and_(SolutionRank.solution_id == solution.solution_id,
+                                       SolutionRank.leaderboard_id.in_(RANKED_BOARDS_BY_ID.keys())))
+                          .all())
+        changed = set()
+        for solution_rank in solution_ranks:
+            leaderboard_id = solution_rank.leaderboard_id
+            reactors = solution_rank.reactors
+
+            closed_up = (SolutionRank.board(leaderboard_id, solution.level_id, reactors)
+                         .filter(SolutionRank.rank > solution_rank.rank))
+            changed |= SolutionRank.row_keys(closed_up)
+            closed_up.update({'rank': SolutionRank.rank - 1}, synchronize_session=False)
+            changed.add((solution.solution_id, leaderboard_id, reactors))
+            db.session.delete(solution_rank)
+            db.session.flush()
+
+            # other solutions are only held off a board by this one if it's
+            # limited to each user's best
+            ranked_board = RANKED_BOARDS_BY_ID[leaderboard_id]
+            if not ranked_board.one_per_user:
+                continue
+            runner_up = SolutionRank.runner_up(solution, ranked_board, reactors).first()
+            if runner_up:
+                changed |= SolutionRank.place(runner_up, leaderboard_id, reactors)
+        changed |= SolutionRank.remove_pareto(solution)
+        SolutionRank.ranks_changed(solution.level_id, changed)
+
+    @staticmethod
+    def place(solution, leaderboard_id, reactors):
+        """Puts a solution on one board, returning the keys (see
+        ranks_changed()) of the rows that changed."""
+        ranked_board = RANKED_BOARDS_BY_ID[leaderboard_id]
+        order = ranked_board.order
+        key = [getattr(solution, name) for name in order]
+        board = SolutionRank.board(leaderboard_id, solution.level_id, reactors)
+        entries = SolutionRank.entries(leaderboard_id, solution.level_id, reactors)
+
+        # if only the user's best solution is ranked and they already have a
+        # better one on the board, there's nothing to do
+        current = None
+        if ranked_board.one_per_user:
+            try:
+                current = entries.filter(Solution.user_id == solution.user_id).one()
+                if [getattr(current.solution, name) for name in order] < key:
+                    return set()
+            except NoResultFound:
+                pass
+
+        rank = entries.filter(sorts_before([getattr(Solution, name) for name in order], key)).count() + 1
+
+        # everything from the new rank down to the user's old entry (or the
+        # end of the board) moves down one place
+        shifted = board.filter(SolutionRank.rank >= rank)
+        if current:
+            shifted = shifted.filter(SolutionRank.rank < current.rank)
+        changed = SolutionRank.row_keys(shifted)
+        if current:
+            changed.add((current.solution_id, leaderboard_id, reactors))
+            db.session.delete(current)
+        shifted.update({'rank': SolutionRank.rank + 1}, synchronize_session=False)
+
+        db.session.add(SolutionRank(solution.solution_id, leaderboard_id, solution.level_id, rank, reactors))
+        db.session.flush()
+        changed.add((solution.solution_id, leaderboard_id, reactors))
+        return changed
+
+    @staticmethod
+    def pareto_key(solution):
+        return tuple(getattr(solution, name) for name in PARETO_ORDER)
+
+    @staticmethod
+    def pareto_bucket(outside_view):
+        """Returns a function giving the staircase a Pareto key belongs to:
+        its reactor count on levels with an outside view, otherwise the one
+        staircase (0) since those levels have a single reactor."""
+        if outside_view:
+            return lambda key: key[PARETO_ORDER.index('reactor_count')]
+        return lambda key: 0
+
+    @staticmethod
+    def pareto_ranks(staircases, outside_view):
+        """Returns the frontier boards for a level's staircases (see
+        skyline.py) as (solution_id, leaderboard_id, reactors, rank) tuples.
+        The "any reactors" board is the frontier across every staircase, and
+        on levels with an outside view each reactor count's staircase is its
+        own board too."""
+        ranks = set()
+        for rank, key in enumerate(frontier(staircases), 1):
+            ranks.add((key[-1], PARETO_LEADERBOARD, 0, rank))
+        if outside_view:
+            for reactors, staircase in staircases.items():
+                if reactors:
+                    for rank, key in enumerate(staircase.keys, 1):
+                        ranks.add((key[-1], PARETO_LEADERBOARD, reactors, rank))
+        return ranks
+
+    @staticmethod
+    def pareto_staircases(level_id, outside_view):
+        """Rebuilds a level's staircases from its stored frontier boards.
+        On levels with an outside view the per-reactor boards hold them all,
+        apart from solutions with no reactors, which are only on the "any
+        reactors" board."""
+        rows = (db.session.query(SolutionRank.reactors, *[getattr(Solution, name) for name in PARETO_ORDER])
+                .join(SolutionRank.solution)
+                .filter(and_(SolutionRank.leaderboard_id == PARETO_LEADERBOARD,
+                             SolutionRank.level_id == level_id)))
+        bucket = SolutionRank.pareto_bucket(outside_view)
+        found = {}
+        for row in rows:
+            key = tuple(row[1:])
+            if row[0] == bucket(key):
+                found.setdefault(row[0], []).append(key)
+        return dict((reactors, Staircase(keys)) for reactors, keys in found.items())
+
+    @staticmethod
+    def store_pareto(level_id, staircases, outside_view):
+        """Brings a level's stored frontier boards in line with staircases,
+        only touching the rows that changed, and returns their keys (see
+        ranks_changed())."""
+        wanted = dict(((solution_id, reactors), rank)
+                      for solution_id, leaderboard_id, reactors, rank
+                      in SolutionRank.pareto_ranks(staircases, outside_view))
+        changed = set()
+        for solution_rank in SolutionRank.query.filter(and_(SolutionRank.leaderboard_id == PARETO_LEADERBOARD,
+                                                            SolutionRank.level_id == level_id)):
+            rank = wanted.pop((solution_rank.solution_id, solution_rank.reactors), None)
+            if rank is None:
+                db.session.delete(solution_rank)
+            elif rank != solution_rank.rank:
+                solution_rank.rank = rank
+            else:
+                continue
+            changed.add((solution_rank.solution_id, PARETO_LEADERBOARD, solution_rank.reactors))
+        for (solution_id, reactors), rank in wanted.items():
+            db.session.add(SolutionRank(solution_id, PARETO_LEADERBOARD, level_id, rank, reactors))
+            changed.add((solution_id, PARETO_LEADERBOARD, reactors))
+        db.session.flush()
+        return changed
+
+    @staticmethod
+    def rebuild_pareto(level_id, outside_view, excluded=None):
+        """Works out a level's frontier boards from all of its solutions
+        (except excluded, a solution id), returning the keys of the rows that
+        changed. Levels whose solutions were all ranked before the frontier
+        board existed (see migrations/003) have nothing stored to update, so
+        they start from here."""
+        keys = (db.session.query(*[getattr(Solution, name) for name in PARETO_ORDER])
+                .filter(and_(Solution.level_id == level_id,
+                             Solution.approved == True)))
+        if excluded is not None:
+            keys = keys.filter(Solution.solution_id != excluded)
+        return SolutionRank.store_pareto(level_id,
+                                         staircases((tuple(row) for row in keys),
+                                                    SolutionRank.pareto_bucket(outside_view)),
+                                         outside_view)
+
+    @staticmethod
+    def insert_pareto(solution):
+        """Adds a newly approved solution to its level's frontier, if it's
+        not dominated, returning the keys of the rows that changed."""
+        outside_view = level_registry.current().by_id[solution.level_id].outside_view
+        staircases = SolutionRank.pareto_staircases(solution.level_id, outside_view)
+        if not staircases:
+            return SolutionRank.rebuild_pareto(solution.level_id, outside_view)
+        key = SolutionRank.pareto_key(solution)
+        if staircases.setdefault(SolutionRank.pareto_bucket(outside_view)(key), Staircase()).insert(key):
+            return SolutionRank.store_pareto(solution.level_id, staircases, outside_view)
+        return set()
+
+    @staticmethod
+    def remove_pareto(solution):
+        """Takes a solution that's about to be deleted off its level's
+        frontier, returning the keys of the rows that changed. The solutions
+        it alone dominated can only be in the box between it and its
+        neighbours on the staircase, so only those are read back to fill the
+        gap."""
+        outside_view = level_registry.current().by_id[solution.level_id].outside_view
+        staircases = SolutionRank.pareto_staircases(solution.level_id, outside_view)
+        if not staircases:
+            return SolutionRank.rebuild_pareto(solution.level_id, outside_view, solution.solution_id)
+        key = SolutionRank.pareto_key(solution)
+        bucket = SolutionRank.pareto_bucket(outside_view)(key)
+        staircase = staircases.get(bucket)
+        if staircase is None or key not in staircase:
+            return set()
+
+        min_cycles, max_cycles, min_symbols, max_symbols = hidden_box(key, *staircase.remove(key))
+        hidden = (db.session.query(*[getattr(Solution, name) for name in PARETO_ORDER])
+                  .filter(and_(Solution.level_id == solution.level_id,
+                               Solution.approved == True,
+                               Solution.solution_id != solution.solution_id,
+                               Solution.cycle_count >= min_cycles,
+                               Solution.symbol_count >= min_symbols)))
+        if outside_view:
+            hidden = hidden.filter(Solution.reactor_count == bucket)
+        if max_cycles is not None:
+            hidden = hidden.filter(Solution.cycle_count <= max_cycles)
+        if max_symbols is not None:
+            hidden = hidden.filter(Solution.symbol_count <= max_symbols)
+        staircase.refill(tuple(row) for row in hidden)
+        if not staircase:
+            del staircases[bucket]
+        return SolutionRank.store_pareto(solution.level_id, staircases, outside_view)
+
+
+class UserRank(db.Model):
+    """A copy of the solution ranks keyed by user, so a user's ranks across
+    every level can be read in one go. The rows are copied again as the
+    solution ranks they come from change, see SolutionRank.ranks_changed()."""
+    __tablename__ = 'user_ranks'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), primary_key=True)
+    level_id = db.Column(db.Integer, db.ForeignKey('levels.level_id'), primary_key=True)
+    leaderboard_id = db.Column(db.Integer, db.ForeignKey('leaderboards.leaderboard_id'), primary_key=True)
+    reactors = db.Column(db.Integer, primary_key=True, default=0)
+    # part of the key since a user can hold several places on a frontier board
+    solution_id = db.Column(db.Integer, db.ForeignKey('solutions.solution_id'), primary_key=True)
+    rank = db.Column(db.Integer)
+
+    @property
+    def rank_str(self):
+        return ordinal(self.rank)
+
+    @staticmethod
+    def update_level(level_id):
+        """Copies every rank for a level again, after it's been rebuilt."""
+        db.session.execute(UserRank.__table__.delete().where(UserRank.level_id == level_id))
+        db.session.execute(COPY_USER_RANKS, {'level_id': level_id})
+
+    @staticmethod
+    def update_rows(level_id, keys):
+        """Copies just the solution ranks with the given (solution_id,
+        leaderboard_id, reactors) keys again, removing the copies of any that
+        no longer exist."""
+        by_board = defaultdict(list)
+        for solution_id, leaderboard_id, reactors in keys:
+            by_board[(leaderboard_id, reactors)].append(solution_id)
+
+        # every old copy goes before any new one is written, since a user's
+        # entry can move from one solution to another
+        chunk_size = MAX_BIND_PARAMS - 3
+        chunks = [(leaderboard_id, reactors, solution_ids[start:start + chunk_size])
+                  for (leaderboard_id, reactors), solution_ids in by_board.items()
+                  for start in range(0, len(solution_ids), chunk_size)]
+        for leaderboard_id, reactors, solution_ids in chunks:
+            db.session.execute(UserRank.__table__.delete().where(and_(UserRank.level_id == level_id,
+                                                                      UserRank.leaderboard_id == leaderboard_id,
+                                                                      UserRank.reactors == reactors,
+                                                                      UserRank.solution_id.in_(solution_ids))))
+        for leaderboard_id, reactors, solution_ids in chunks:
+            params = dict(('solution_id_{0}'.format(i), solution_id) for i, solution_id in enumerate(solution_ids))
+            params.update({'level_id': level_id, 'leaderboard_id': leaderboard_id, 'reactors': reactors})
+            db.session.execute(COPY_USER_RANKS +
+                               " AND solution_ranks.leaderboard_id = :leaderboard_id"
+                               " AND solution_ranks.reactors = :reactors"
+                               " AND solution_ranks.solution_id IN ({0})".format(
+                                   ', '.join(':solution_id_{0}'.format(i) for i in range(len(solution_ids)))),
+                               params)
+
+    @staticmethod
+    def for_user(user_id):
+        """Returns the user's ranks as a dict of {solution_id: {(leaderboard_id,
+        by_reactors): rank}}, where by_reactors is whether the rank is on a
+        board for a single reactor count."""
+        ranks = defaultdict(dict)
+        for user_rank in UserRank.query.filter_by(user_id=user_id):
+            ranks[user_rank.solution_id][(user_rank.leaderboard_id, bool(user_rank.reactors))] = user_rank
+        return ranks
+
 
 class Component(db.Model):
     __tablename__ = 'components'
@@ -339,6 +1340,15 @@ class Component(db.Model):
         self.x = x
         self.y = y
 
+    @staticmethod
+    def for_solution(solution_id):
+        """Returns a query for a solution's components in drawing order, with
+        their members and pipes."""
+        return (Component.query
+                .options(subqueryload('members'), subqueryload('pipes'))
+                .filter(Component.solution_id == solution_id)
+                .order_by(Component.x, Component.y))
+
 
 class FixedComponent(db.Model):
     __tablename__ = 'components_fixed'
@@ -415,6 +1425,16 @@ class Member(db.Model):
         self.element_type = element_type
         self.element = element
     
+    @property
+    def sprite_class(self):
+        """The CSS class showing this member's image out of the sprite atlas
+        (see build_sprites.py). Member types without an image get a class
+        with no image, so one odd member doesn't break the whole page."""
+        image_name = self.image_name
+        if image_name is None:
+            return UNKNOWN_SPRITE_CLASS
+        return 'sprite-'+image_name[:-len('.png')]
+
     @property
     def image_name(self):
         variant = ""
@@ -493,3 +1513,31 @@ class Member(db.Model):
             return self.color+"-sync.png"
         elif self.type == "instr-toggle":
             return self.color+"-toggle_"+self.ARROW_DIRS[self.arrow_dir]+".png"
+
+
+
+# secondary indexes for the queries behind each page, see
+# check_query_plans.py; existing databases get them from migrations/
+db.Index('ix_solutions_level_approved_user',
+         Solution.__table__.c.level_id, Solution.__table__.c.approved, Solution.__table__.c.user_id)
+db.Index('ix_solutions_user_approved', Solution.__table__.c.user_id, Solution.__table__.c.approved)
+# approved solutions in the cycles and symbols boards' orders; only
+# PostgreSQL leaves out unapproved ones
+db.Index('ix_solutions_approved_by_cycles',
+         *[Solution.__table__.c[column] for column in ('level_id',) + RANKED_BOARDS_BY_SLUG['cycles'].order],
+         postgresql_where=Solution.__table__.c.approved == True)
+db.Index('ix_solutions_approved_by_symbols',
+         *[Solution.__table__.c[column] for column in ('level_id',) + RANKED_BOARDS_BY_SLUG['symbols'].order],
+         postgresql_where=Solution.__table__.c.approved == True)
+db.Index('ix_solution_ranks_board',
+         SolutionRank.__table__.c.level_id, SolutionRank.__table__.c.leaderboard_id,
+         SolutionRank.__table__.c.reactors, SolutionRank.__table__.c.rank)
+db.Index('ix_user_ranks_level_id', UserRank.__table__.c.level_id)
+db.Index('ix_components_solution_id', Component.__table__.c.solution_id)
+db.Index('ix_components_fixed_level_id', FixedComponent.__table__.c.level_id)
+db.Index('ix_members_component_id', Member.__table__.c.component_id)
+db.Index('ix_pipes_component_id', Pipe.__table__.c.component_id)
+db.Index('ix_levels_slug', Level.__table__.c.slug)
+db.Index('ix_leaderboards_slug', Leaderboard.__table__.c.slug)
+db.Index('ix_users_username', User.__table__.c.username)
+db.Index('ix_outbox_status_next_attempt', OutgoingEmail.__table__.c.status, OutgoingEmail.__table__.c.next_attempt)
@@ -0,0 +1,84 @@
+from bisect import bisect_left
+import threading
+import time
+
+import bcrypt
+
+
+# upper bounds (in seconds) of the buckets hash times are counted in
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class PasswordHasher(object):
+    """Runs bcrypt with at most max_concurrent hashes at a time in the
+    process, so a burst of logins can't take every CPU away from ordinary
+    page views; requests beyond that wait their turn.
+
+    Keeps counts of how long hashes take and how many requests are waiting,
+    see metrics().
+    """
+
+    def __init__(self, max_concurrent=2, work_factor=12):
+        self.max_concurrent = max_concurrent
+        self.work_factor = work_factor
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+
+        self.waiting = 0
+        self.running = 0
+        self.max_waiting = 0
+        self.hashes = 0
+        self.hash_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def hash(self, password):
+        return self.run(password, bcrypt.gensalt(self.work_factor))
+
+    def check(self, password, hashed):
+        return self.run(password, hashed) == hashed
+
+    def needs_rehash(self, hashed):
+        """Whether a stored hash was made with a different work factor than
+        the current one. bcrypt hashes look like $2a$<work factor>$..."""
+        try:
+            return int(hashed.split('$')[2]) != self.work_factor
+        except (IndexError, ValueError):
+            return True
+
+    def run(self, password, salt):
+        queued = time.time()
+        with self.lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        self.slots.acquire()
+        started = time.time()
+        with self.lock:
+            self.waiting -= 1
+            self.running += 1
+
+        try:
+            return bcrypt.hashpw(password, salt)
+        finally:
+            self.slots.release()
+            finished = time.time()
+            with self.lock:
+                self.running -= 1
+                self.hashes += 1
+                self.hash_seconds += finished - started
+                self.wait_seconds += started - queued
+                self.latency_counts[bisect_left(LATENCY_BUCKETS, finished - started)] += 1
+
+    def metrics(self):
+        """Returns a snapshot of the hasher's counters. latency_counts has a
+        count for each of LATENCY_BUCKETS, plus one for slower hashes."""
+        with self.lock:
+            return {'max_concurrent': self.max_concurrent,
+                    'work_factor': self.work_factor,
+                    'waiting': self.waiting,
+                    'running': self.running,
+                    'max_waiting': self.max_waiting,
+                    'hashes': self.hashes,
+                    'hash_seconds': self.hash_seconds,
+                    'wait_seconds': self.wait_seconds,
+                    'latency_counts': list(self.latency_counts)}
@@ -0,0 +1,144 @@
+"""Writes synthetic SpaceChem saves, for benchmarking and testing uploads.
+
+    python savegen.py OUTPUT [--levels N] [--reactors N] [--members N]
+                             [--pipes N] [--seed N] [--names NAME,...]
+
+OUTPUT is a .user file, or a .gz of one. Every level in the save is passed,
+with random statistics and a random layout of reactors, each holding about
+the given number of members (instructions and features) and with pipes
+leading out of it. Levels are named bench-level-1, bench-level-2 and so on
+unless --names is given; the site only reads levels it knows about.
+"""
+import gzip
+from optparse import OptionParser
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+
+
+REACTOR_WIDTH = 10
+REACTOR_HEIGHT = 8
+
+# the tables of a save that the site reads, see read_savefile()
+SAVE_SCHEMA = ("CREATE TABLE Level (id TEXT PRIMARY KEY, passed INTEGER, mastered INTEGER, "
+               "cycles INTEGER, symbols INTEGER, reactors INTEGER);"
+               "CREATE TABLE Component (rowid INTEGER PRIMARY KEY, level_id TEXT, type TEXT, "
+               "x INTEGER, y INTEGER, name TEXT);"
+               "CREATE TABLE Member (rowid INTEGER PRIMARY KEY, component_id INTEGER, type TEXT, "
+               "arrow_dir INTEGER, choice INTEGER, layer INTEGER, x INTEGER, y INTEGER, "
+               "element_type INTEGER, element INTEGER);"
+               "CREATE TABLE Pipe (component_id INTEGER, output_id INTEGER, x INTEGER, y INTEGER);")
+
+ARROW_DIRS = (180, -90, 0, 90)
+# the layers members are drawn on, see Member.color
+LAYERS = {'blue': 16, 'red': 64, 'feature': 1}
+INSTRUCTIONS = ('instr-grab', 'instr-bond', 'instr-rotate', 'instr-sync', 'instr-input', 'instr-output',
+                'instr-sensor', 'instr-toggle', 'instr-control', 'instr-fuse', 'instr-split', 'instr-swap')
+FEATURES = ('feature-bonder', 'feature-bonder-plus', 'feature-bonder-minus', 'feature-sensor',
+            'feature-fuser', 'feature-splitter', 'feature-tunnel')
+
+
+def level_names(count):
+    return ['bench-level-{0}'.format(number) for number in range(1, count + 1)]
+
+
+def reactor_members(rng, num_members):
+    """Returns member rows (without a component id) for one reactor: a start
+    for each color, features, then instructions and arrows split between the
+    colors. Members of the same color never share a cell, except arrows."""
+    members = []
+    num_features = min(num_members // 10, 8)
+    cells = [(x, y) for x in range(REACTOR_WIDTH) for y in range(REACTOR_HEIGHT)]
+    rng.shuffle(cells)
+    for i in range(num_features):
+        x, y = cells[i]
+        members.append(('feature', rng.choice(FEATURES), 0, 0, x, y, 0, 0))
+
+    per_color = max(num_members - num_features, 2) // 2
+    for color in ('blue', 'red'):
+        instructions = [(x, y) for x in range(REACTOR_WIDTH) for y in range(REACTOR_HEIGHT)]
+        rng.shuffle(instructions)
+        arrows = instructions[:]
+        rng.shuffle(arrows)
+        x, y = instructions.pop()
+        members.append((color, 'instr-start', rng.choice(ARROW_DIRS), 0, x, y, 0, 0))
+        num_arrows = (per_color - 1) // 3
+        for i in range(min(per_color - 1 - num_arrows, len(instructions))):
+            x, y = instructions.pop()
+            members.append((color, rng.choice(INSTRUCTIONS), rng.choice(ARROW_DIRS), rng.randint(0, 1),
+                            x, y, 1, rng.randint(1, 109)))
+        for i in range(min(num_arrows, len(arrows))):
+            x, y = arrows.pop()
+            members.append((color, 'instr-arrow', rng.choice(ARROW_DIRS), 0, x, y, 0, 0))
+
+    return [(type, arrow_dir, choice, LAYERS[layer], x, y, element_type, element)
+            for layer, type, arrow_dir, choice, x, y, element_type, element in members]
+
+
+def write_save(path, names, reactors=3, members=40, pipes=8, seed=0):
+    """Writes a save to path with a passed solution for each level name,
+    returning the number of levels written."""
+    rng = random.Random(seed)
+    if path.endswith('.gz'):
+        handle, database = tempfile.mkstemp(suffix='.user')
+        os.close(handle)
+        os.remove(database)
+    else:
+        database = path
+        if os.path.exists(path):
+            os.remove(path)
+
+    conn = sqlite3.connect(database)
+    try:
+        conn.executescript(SAVE_SCHEMA)
+        component_id = 0
+        for name in names:
+            num_reactors = rng.randint(1, reactors) if reactors > 1 else 1
+            conn.execute("INSERT INTO Level VALUES (?, 1, 0, ?, ?, ?)",
+                         (name, rng.randint(50, 50000), rng.randint(5, 400), num_reactors))
+            for reactor in range(num_reactors):
+                component_id += 1
+                conn.execute("INSERT INTO Component VALUES (?, ?, 'drag-assembly-reactor', ?, ?, NULL)",
+                             (component_id, name, 2 + (reactor % 4) * 5, 2 + (reactor // 4) * 5))
+                conn.executemany("INSERT INTO Member (component_id, type, arrow_dir, choice, layer, x, y, "
+                                 "element_type, element) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [(component_id,) + member for member in reactor_members(rng, members)])
+                conn.executemany("INSERT INTO Pipe VALUES (?, ?, ?, ?)",
+                                 [(component_id, pipe % 2, 4 + pipe // 2, 1 + pipe % 2) for pipe in range(pipes)])
+        conn.commit()
+    finally:
+        conn.close()
+
+    if database != path:
+        source = open(database, 'rb')
+        destination = gzip.open(path, 'wb')
+        try:
+            shutil.copyfileobj(source, destination)
+        finally:
+            source.close()
+            destination.close()
+            os.remove(database)
+    return len(names)
+
+
+def main():
+    parser = OptionParser(usage='%prog OUTPUT [options]')
+    parser.add_option('--levels', type='int', default=20, help='number of passed levels [%default]')
+    parser.add_option('--reactors', type='int', default=3, help='most reactors in a solution [%default]')
+    parser.add_option('--members', type='int', default=40, help='members in each reactor [%default]')
+    parser.add_option('--pipes', type='int', default=8, help='pipe segments from each reactor [%default]')
+    parser.add_option('--seed', type='int', default=0, help='random seed [%default]')
+    parser.add_option('--names', help='comma-separated internal names of the levels, instead of made up ones')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('an output file is required')
+
+    names = options.names.split(',') if options.names else level_names(options.levels)
+    written = write_save(args[0], names, options.reactors, options.members, options.pipes, options.seed)
+    print('Wrote {0} levels to {1}'.format(written, args[0]))
+
+
+if __name__ == '__main__':
+    main()
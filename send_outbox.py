@@ -0,0 +1,86 @@
+"""Sends the emails queued in the outbox table.
+
+    python send_outbox.py [--once]
+
+Runs until stopped, checking for new emails every POLL_INTERVAL seconds, or
+with --once sends whatever is due and exits. Only one sender should run at
+a time. Which service sends the emails is set by MAIL_BACKEND, see
+mailers.py.
+"""
+from datetime import timedelta
+from optparse import OptionParser
+import time
+
+from sqlalchemy import func, select
+
+from mailers import make_mailer
+from models import OutgoingEmail, db
+from spacechem import app
+
+
+# seconds to wait before checking an empty outbox again
+POLL_INTERVAL = 5
+
+BATCH_SIZE = 50
+
+# a failed email is retried after RETRY_DELAY seconds, doubling with each
+# further failure up to MAX_RETRY_DELAY, and given up on after MAX_ATTEMPTS
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 60 * 60
+MAX_ATTEMPTS = 8
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY))
+
+
+def send_batch(mailer, from_address):
+    """Sends the emails that are due, up to BATCH_SIZE of them, returning how
+    many were tried. Each email's outcome is committed as soon as it's
+    known."""
+    # the outbox's times come from the database's clock
+    now = db.session.execute(select([func.now()])).scalar()
+    emails = OutgoingEmail.due(now, BATCH_SIZE).all()
+    for email in emails:
+        email.attempts += 1
+        try:
+            mailer.send(from_address, email.to_address, email.subject, email.body)
+        except Exception as e:
+            app.logger.exception('Sending email {0} failed'.format(email.email_id))
+            email.last_error = str(e)[:255]
+            if email.attempts >= MAX_ATTEMPTS:
+                email.status = 'failed'
+            else:
+                email.next_attempt = now + retry_delay(email.attempts)
+            # start from a fresh connection in case that one's broken
+            mailer.close()
+        else:
+            email.status = 'sent'
+        # recorded straight away, so a crash later in the batch can't send
+        # this email again
+        db.session.commit()
+    return len(emails)
+
+
+def main():
+    parser = OptionParser(usage='%prog [--once]')
+    parser.add_option('--once', action='store_true', default=False,
+                      help='send the emails that are due and exit')
+    options, args = parser.parse_args()
+
+    mailer = make_mailer(app.config)
+    from_address = '"SolutionNet" <{0}>'.format(app.config['FROM_EMAIL_ADDRESS'])
+    try:
+        while True:
+            sent = send_batch(mailer, from_address)
+            if sent == BATCH_SIZE:
+                continue
+            if options.once:
+                break
+            time.sleep(POLL_INTERVAL)
+    finally:
+        mailer.close()
+
+
+if __name__ == '__main__':
+    main()
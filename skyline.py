@@ -0,0 +1,89 @@
+from bisect import bisect_left, bisect_right
+
+
+class Staircase(object):
+    """The solutions not beaten on both of two costs by another, kept as
+    sorted keys: tuples whose first two items are the costs (lower is
+    better) and whose later items break ties, so of two solutions with the
+    same costs only the one with the lower key is kept.
+
+    Sorted this way the first cost rises and the second falls along the
+    staircase, so each change is a binary search plus the run of keys it
+    pushes off, rather than a comparison against every other solution.
+    """
+
+    def __init__(self, keys=()):
+        self.keys = []
+        for key in sorted(keys):
+            self.insert(key)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def insert(self, key):
+        """Adds key unless it's dominated, removing the keys it dominates.
+        Returns whether it was added."""
+        i = bisect_left(self.keys, key)
+        # the key just before has the lowest second cost of everything that
+        # sorts before this one
+        if i > 0 and self.keys[i - 1][1] <= key[1]:
+            return False
+        end = i
+        while end < len(self.keys) and self.keys[end][1] >= key[1]:
+            end += 1
+        self.keys[i:end] = [key]
+        return True
+
+    def remove(self, key):
+        """Removes key, returning the keys either side of it (or None at the
+        ends). Only keys inside the box between those two and key itself can
+        have been dominated by key alone, see hidden_box() and refill()."""
+        i = bisect_left(self.keys, key)
+        del self.keys[i]
+        return (self.keys[i - 1] if i > 0 else None,
+                self.keys[i] if i < len(self.keys) else None)
+
+    def refill(self, keys):
+        """Inserts keys that a removed key may have been hiding."""
+        for key in sorted(keys):
+            self.insert(key)
+
+    def dominates(self, first, second):
+        """Whether a key on the staircase is at least as good as the costs
+        (first, second) on both."""
+        i = bisect_right(self.keys, (first, float('inf')))
+        return i > 0 and self.keys[i - 1][1] <= second
+
+
+def hidden_box(key, previous, following):
+    """Returns the bounds (first_min, first_max, second_min, second_max),
+    inclusive, of the costs of the keys that a removed key may have been
+    hiding, given its neighbours from Staircase.remove(). A maximum is None
+    where there's no neighbour on that side."""
+    return (key[0], following[0] if following else None,
+            key[1], previous[1] if previous else None)
+
+
+def staircases(keys, bucket):
+    """Splits keys into a Staircase for each value of bucket(key)."""
+    found = {}
+    for key in sorted(keys):
+        found.setdefault(bucket(key), Staircase()).insert(key)
+    return found
+
+
+def frontier(staircases):
+    """Returns the keys, in order, on the frontier of three costs where the
+    third is the bucket each staircase ({bucket: Staircase}) is for: those
+    that no staircase for a lower bucket dominates."""
+    buckets = sorted(staircases)
+    keys = []
+    for position, bucket in enumerate(buckets):
+        lower = [staircases[lower_bucket] for lower_bucket in buckets[:position]]
+        keys += [key for key in staircases[bucket].keys
+                 if not any(staircase.dominates(key[0], key[1]) for staircase in lower)]
+    return sorted(keys)
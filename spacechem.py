@@ -1,19 +1,35 @@
+from collections import defaultdict
 import os
-from sqlite3 import DatabaseError
-import zipfile
 
-from boto.exception import BotoServerError
-from flask import Flask, render_template, abort, request, redirect, session, url_for, flash
+from flask import Flask, Response, render_template, abort, request, redirect, session, url_for, flash, jsonify
 from flaskext.sqlalchemy import SQLAlchemy
 from flaskext.uploads import configure_uploads, patch_request_class
 from sqlalchemy import func, cast, Integer
 from sqlalchemy.orm.exc import NoResultFound
 
+from cache import LRUCache, PageCache, make_backend
+from metrics import Metrics
+from passwords import PasswordHasher
+from uploadqueue import UploadQueue
+
 
 app = Flask(__name__)
 app.config.from_pyfile('spacechem.cfg')
+# settings that override spacechem.cfg for one run, such as bench_suite.py's
+app.config.from_envvar('SPACECHEM_SETTINGS', silent=True)
 app.jinja_env.add_extension('jinja2.ext.do')
 db = SQLAlchemy(app)
+# by default the queue sits beside the upload folder rather than in it, where
+# it could be served along with the saves
+upload_queue = UploadQueue(app.config.get('UPLOAD_QUEUE_PATH', os.path.join(
+    os.path.dirname(os.path.normpath(app.config.get('UPLOADS_DEFAULT_DEST', app.root_path))), 'upload_queue.db')))
+render_cache = LRUCache(app.config.get('RENDER_CACHE_SIZE', 500))
+page_cache = PageCache(make_backend(app.config, app.config.get('PAGE_CACHE_SIZE', 1000)),
+                       app.config.get('PAGE_CACHE_TIMEOUT', 300))
+password_hasher = PasswordHasher(app.config.get('PASSWORD_HASH_CONCURRENCY', 2),
+                                 app.config.get('BCRYPT_WORK_FACTOR', 12))
+metrics = Metrics()
+metrics.init_app(app)
 
 
 from models import *
@@ -25,6 +41,9 @@ configure_uploads(app, savefiles)
 patch_request_class(app)
 
 
+LEADERBOARD_PAGE_SIZE = 50
+
+
 # main page
 @app.route('/')
 def main_page():
@@ -45,17 +64,13 @@ def register():
     if form.validate_on_submit():
         user = User(form.username.data, form.email.data, form.password.data)
         db.session.add(user)
-        db.session.commit()
 
-        # send email through SES
+        # sent in the background by send_outbox.py
         subject = 'Account created for SpaceChem SolutionNet'
         body = ("Thanks for registering on SpaceChem SolutionNet (http://spacechem.net)\n\n"
                 "Your username is: {0}").format(user.username)
-
-        try:
-            ses_email(app.config, user.email, subject, body)
-        except BotoServerError:
-            flash('Sending welcome email failed.', 'error')
+        db.session.add(OutgoingEmail(user.email, subject, body))
+        db.session.commit()
 
         session['user_id'] = user.user_id
         session['username'] = user.username
@@ -81,6 +96,9 @@ def login():
             flash('Incorrect login info', 'error')
             return redirect(url_for('login'))
 
+        # check_password may have upgraded the stored hash
+        db.session.commit()
+
         if form.remember.data:
             session.permanent = True
         session['user_id'] = user.user_id
@@ -131,16 +149,17 @@ def upload():
     if 'username' not in session:
         return redirect(url_for('main_page'))
 
-    num_unapproved = (Solution.query
-                      .filter(and_(Solution.user_id == session['user_id'],
-                                   Solution.approved == False))
-                      .count())
+    num_unapproved = Solution.unapproved_for_user(session['user_id']).count()
     if num_unapproved > 0:
         flash("You still have unapproved solutions from your last upload, "
               "please decide which of these to keep first before uploading "
               "another save.")
         return redirect('/unapproved')
 
+    job = upload_queue.pending_for_user(session['user_id'])
+    if job:
+        return redirect(url_for('upload_status', job_id=job['job_id']))
+
     form = UploadForm()
     if form.validate_on_submit():
         savefile = SaveFile(session['user_id'])
@@ -148,57 +167,41 @@ def upload():
         db.session.commit()
         filename = savefiles.save(request.files['save'],
                                   name=session['username']+'-'+str(savefile.file_id)+'.')
-        try:
-            if filename.endswith('.zip'):
-                if not zipfile.is_zipfile(savefiles.path(filename)):
-                    raise zipfile.BadZipfile
-                zipped = zipfile.ZipFile(savefiles.path(filename), 'r')
-                zipped_files = zipped.infolist()
-                if len(zipped_files) != 1:
-                    raise zipfile.BadZipfile
-                if not zipped_files[0].filename.endswith('.user'):
-                    raise zipfile.BadZipfile
-                
-                unzipped = open(savefiles.path(filename.replace('.zip', '.user')), 'w')
-                unzipped.writelines(zipped.open(zipped_files[0], 'r').readlines())
-                unzipped.close()
-                
-            results = savefile.process(form.upload_all.data)
-        except zipfile.BadZipfile:
-            flash('Invalid zipped SpaceChem save file. Please ensure that you '
-                  'are uploading the correct file, and that it is a zip file '
-                  'containing only a single save file.', 'error')
-            db.session.delete(savefile)
-            db.session.commit()
-            os.remove(savefiles.path(filename))
-            return redirect('/upload')
-        except DatabaseError:
-            flash('Invalid SpaceChem save file. Please ensure that you are '
-                  'uploading the correct file.', 'error')
-            db.session.delete(savefile)
-            db.session.commit()
-            if filename.endswith('.zip'):
-                os.remove(savefiles.path(filename.replace('.zip', '.user')))
-            os.remove(savefiles.path(filename))
-            return redirect('/upload')
-
-        if (form.upload_all.data):
-            flash("Uploaded {0} solutions, skipped {1} previously-uploaded.".format(results[0], results[1]))
-            return redirect('/user/'+session['username'])
-        else:
-            flash("Found {0} potential solutions to upload, skipped {1} previously-uploaded.".format(results[0], results[1]))
-            if results[0] == 0:
-                return redirect('/user/'+session['username'])
-            else:
-                return redirect('/unapproved')
+
+        # the save is processed by the upload workers, see upload_worker.py
+        job_id = upload_queue.enqueue(savefile.file_id, session['user_id'], filename, form.upload_all.data)
+        return redirect(url_for('upload_status', job_id=job_id))
     return render_template("upload.html", form=form)
 
 
+def get_upload_job(job_id):
+    job = upload_queue.get(job_id)
+    if not job or job['user_id'] != session.get('user_id'):
+        abort(404)
+    return job
+
+
+@app.route('/upload/<int:job_id>')
+def upload_status(job_id):
+    job = get_upload_job(job_id)
+    return render_template('upload_status.html', job=job)
+
+
+@app.route('/upload/<int:job_id>/progress')
+def upload_progress(job_id):
+    job = get_upload_job(job_id)
+    return jsonify(status=job['status'],
+                   levels_parsed=job['levels_parsed'],
+                   solutions_inserted=job['solutions_inserted'],
+                   ranks_refreshed=job['ranks_refreshed'],
+                   uploaded=job['uploaded'],
+                   skipped=job['skipped'],
+                   error=job['error'])
+
+
 @app.route('/unapproved', methods=['GET', 'POST'])
 def unapproved():
-    solutions = (Solution.query
-                 .filter(and_(Solution.user_id == session['user_id'],
-                              Solution.approved == False))
+    solutions = (Solution.unapproved_for_user(session['user_id'])
                  .join(Level)
                  .order_by('levels.category', 'order1', 'order2')
                  .all())
@@ -210,12 +213,15 @@ def unapproved():
             solution_ids = [int(id) for id in request.form.keys()]
             query = (Solution.query
                      .filter(and_(Solution.user_id == session['user_id'],
-                                  Solution.solution_id.in_(solution_ids))))
-            updated = query.update({'approved': True}, synchronize_session=False)
-            db.session.commit()
+                                  Solution.solution_id.in_(solution_ids),
+                                  Solution.approved == False)))
             approved = query.all()
+            updated = query.update({'approved': True}, synchronize_session=False)
+            # the approvals and their ranks are committed together, so a
+            # failure can't leave approved solutions off the leaderboards
             for solution in approved:
-                SolutionRank.recalculate(solution.level_id)
+                SolutionRank.insert_solution(solution)
+            db.session.commit()
 
         to_delete = (Solution.query
                      .filter(and_(Solution.user_id == session['user_id'],
@@ -234,7 +240,7 @@ def unapproved():
 @app.route('/solution/<slug>/<solution_id>', methods=['GET', 'POST'])
 def display_solution(slug, solution_id):
     try:
-        solution = Solution.query.filter_by(solution_id=solution_id).one()
+        solution = Solution.with_details(solution_id).one()
 
         # prevent viewing non-approved solutions by anyone except owner
         if not solution.approved and session['user_id'] != solution.user_id:
@@ -258,9 +264,7 @@ def display_solution(slug, solution_id):
         flash('Solution details updated')
         return redirect('/solution/'+slug+'/'+solution_id)
 
-    reactors = process_solution(solution)
-
-    overview = process_overview(solution)
+    reactors, overview = solution.render_model()
 
     return render_template('solution.html',
                            num_reactors=len(reactors),
@@ -268,6 +272,7 @@ def display_solution(slug, solution_id):
                            overview=overview,
                            solution=solution,
                            ELEMENTS=Member.ELEMENTS,
+                           PATH_NAMES=PATH_NAMES,
                            form=form)
 
 
@@ -284,15 +289,35 @@ def delete_solution(solution_id):
     if not request.args or not request.args['confirm']:
         return render_template('solution_delete.html', solution=solution)
     else:
-        level_id = solution.level_id
+        SolutionRank.remove_solution(solution)
+        render_cache.delete(solution.solution_id)
         db.session.delete(solution)
         db.session.commit()
-        SolutionRank.recalculate(level_id)
 
         flash('Solution deleted')
         return redirect('/user/'+session['username'])
 
 
+def profile_rank_links(level_slug, solution_ranks):
+    """Returns {column: [(url, text)]} for the places a solution holds, given
+    as returned by UserRank.for_user(), under the solution column each board
+    is listed under on profiles."""
+    links = defaultdict(list)
+    for board in BOARD_PAGES:
+        url = '/leaderboards/{0}/{1}'.format(level_slug, board.slug)
+        rank = solution_ranks.get((board.leaderboard_id, False))
+        if rank:
+            links[board.profile_column].append((url, board.place_name or rank.rank_str))
+        rank = solution_ranks.get((board.leaderboard_id, True))
+        if rank:
+            if board.place_name:
+                text = '{0}R {1}'.format(rank.reactors, board.place_name)
+            else:
+                text = '{0} ({1}R)'.format(rank.rank_str, rank.reactors)
+            links[board.profile_column].append(('{0}/{1}-reactors'.format(url, rank.reactors), text))
+    return links
+
+
 @app.route('/user/<username>')
 def user_page(username):
     try:
@@ -300,103 +325,55 @@ def user_page(username):
     except NoResultFound:
         abort(404)
 
-    main_solutions = (Solution.query
-                      .filter(and_(Level.category == 'main',
-                                   Solution.user_id == user.user_id,
-                                   Solution.approved == True))
-                      .join(Solution.level)
-                      .order_by('levels.order1', 'levels.order2')
-                      .all())
-    researchnet_solutions = (Solution.query
-                             .filter(and_(Level.category == 'researchnet',
-                                          Solution.user_id == user.user_id,
-                                          Solution.approved == True))
-                             .join(Solution.level)
-                             .order_by('levels.order1', 'levels.order2')
-                             .all())
-    tf2_solutions = (Solution.query
-                     .filter(and_(Level.category == 'tf2',
-                                  Solution.user_id == user.user_id,
-                                  Solution.approved == True))
-                     .join(Solution.level)
-                     .order_by('levels.order1', 'levels.order2')
-                     .all())
-    corvi_solutions = (Solution.query
-                       .filter(and_(Level.category == '63corvi',
-                                    Solution.user_id == user.user_id,
-                                    Solution.approved == True))
-                       .join(Solution.level)
-                       .order_by('levels.order1', 'levels.order2')
-                       .all())
+    solutions = Solution.for_user_page(user.user_id).all()
+    by_category = defaultdict(list)
+    for solution in solutions:
+        by_category[solution.level.category].append(solution)
+    categories = [(title, by_category[category])
+                  for category, title in LEVEL_CATEGORIES
+                  if by_category[category]]
+
+    ranks = UserRank.for_user(user.user_id)
+    rank_links = dict((solution.solution_id, profile_rank_links(solution.level.slug,
+                                                                ranks.get(solution.solution_id, {})))
+                      for solution in solutions)
+    solution_columns = SOLUTION_COLUMNS
 
     return render_template('user.html', **locals())
 
 
 @app.route('/solution-stats')
+@page_cache.cached(lambda: ['levels'])
 def solution_stats_list():
-    main_levels = (Level.query
-                   .filter_by(category='main')
-                   .order_by('order1', 'order2')
-                   .all())
-    published_levels = (Level.query
-                        .filter_by(category='researchnet')
-                        .order_by('order1', 'order2')
-                        .all())
-    tf2_levels = (Level.query
-                  .filter_by(category='tf2')
-                  .order_by('order1', 'order2')
-                  .all())
-    corvi_levels = (Level.query
-                    .filter_by(category='63corvi')
-                    .order_by('order1', 'order2')
-                    .all())
+    levels = level_registry.current()
+    main_levels = levels.in_category('main')
+    published_levels = levels.in_category('researchnet')
+    tf2_levels = levels.in_category('tf2')
+    corvi_levels = levels.in_category('63corvi')
 
     return render_template('solution_stats_list.html', **locals())
 
 
 @app.route('/solution-stats/<slug>')
+@page_cache.cached(lambda slug: ['level:' + slug])
 def solution_stats(slug):
+    level = level_registry.current().by_slug.get(slug)
+    if level is None:
+        abort(404)
     try:
-        level = Level.query.filter_by(slug=slug).one() 
-        scores = (OfficialScores.query
-                  .filter_by(level_id=level.level_id)
-                  .order_by(desc('fetch_date'))
-                  .limit(1)
-                  .one())
+        scores = OfficialScores.newest(level.level_id).one()
     except NoResultFound:
         abort(404)
-    
-    chart_data = dict()
 
-    # convert all the data to ints, after converting to floats first
-    cycles_split = map(int, map(float, scores.cycle_counts.split()))
-    reactors_split = map(int, map(float, scores.reactor_counts.split()))
-    symbols_split = map(int, map(float, scores.symbol_counts.split()))
+    chart_data = scores.chart_data()
 
-    # use reactor sum for total because the other ones can have solutions "off the chart" that aren't counted
-    chart_data['total_solutions'] = sum(reactors_split[6:])
-    
-    process_chart_data(reactors_split, chart_data, 'reactor')
-    process_chart_data(cycles_split, chart_data, 'cycle')
-    process_chart_data(symbols_split, chart_data, 'symbol')
-    
     try:
-        best_by_cycles = (SolutionRank.query
-                          .filter(and_(SolutionRank.leaderboard_id == 1,
-                                       SolutionRank.level_id == level.level_id,
-                                       SolutionRank.reactors == 0,
-                                       SolutionRank.rank == 1))
-                          .one())
+        best_by_cycles = SolutionRank.best(RANKED_BOARDS_BY_SLUG['cycles'].leaderboard_id, level.level_id).one()
     except NoResultFound:
         best_by_cycles = None
 
     try:
-        best_by_symbols = (SolutionRank.query
-                           .filter(and_(SolutionRank.leaderboard_id == 2,
-                                        SolutionRank.level_id == level.level_id,
-                                        SolutionRank.reactors == 0,
-                                        SolutionRank.rank == 1))
-                           .one())
+        best_by_symbols = SolutionRank.best(RANKED_BOARDS_BY_SLUG['symbols'].leaderboard_id, level.level_id).one()
     except NoResultFound:
         best_by_symbols = None
 
@@ -408,40 +385,60 @@ def solution_stats(slug):
 
 
 @app.route('/leaderboards')
+@page_cache.cached(lambda: ['levels'])
 def leaderboards_list():
-    main_levels = Level.query.filter_by(category='main').order_by('order1','order2').all()
-    published_levels = Level.query.filter_by(category='researchnet').order_by('order1','order2').all()
-    tf2_levels = Level.query.filter_by(category='tf2').order_by('order1','order2').all()
-    corvi_levels = Level.query.filter_by(category='63corvi').order_by('order1','order2').all()
+    levels = level_registry.current()
+    main_levels = levels.in_category('main')
+    published_levels = levels.in_category('researchnet')
+    tf2_levels = levels.in_category('tf2')
+    corvi_levels = levels.in_category('63corvi')
 
     return render_template('leaderboard_list.html', **locals())
 
 
 @app.route('/leaderboards/<level_slug>/<leaderboard_slug>', defaults={'reactors': 0})
 @app.route('/leaderboards/<level_slug>/<leaderboard_slug>/1-reactor', defaults={'reactors': 1})
-@app.route('/leaderboards/<level_slug>/<leaderboard_slug>/<reactors>-reactors')
+@app.route('/leaderboards/<level_slug>/<leaderboard_slug>/<int:reactors>-reactors')
+@page_cache.cached(lambda level_slug, leaderboard_slug, reactors: ['level:' + level_slug])
 def leaderboard(level_slug, leaderboard_slug, reactors):
-    try:
-        level = Level.query.filter_by(slug=level_slug).one()
-        leaderboard = Leaderboard.query.filter_by(slug=leaderboard_slug).one()
-    except NoResultFound:
+    level = level_registry.current().by_slug.get(level_slug)
+    if level is None:
         abort(404)
-
-    solution_ranks = (SolutionRank.query
-                      .filter(and_(SolutionRank.leaderboard_id == leaderboard.leaderboard_id,
-                                   SolutionRank.level_id == level.level_id,
-                                   SolutionRank.reactors == reactors))
-                      .order_by('rank')
-                      .all())
-
-    reactor_options = (db.session.query(Solution.reactor_count)
-                       .filter(and_(Solution.level_id == level.level_id,
-                                    Solution.reactor_count != reactors))
-                       .distinct()
-                       .order_by(Solution.reactor_count)
-                       .all())
-
-    return render_template('leaderboard.html', type=leaderboard.slug, **locals())
+    board = BOARD_PAGES_BY_SLUG.get(leaderboard_slug)
+    if board is None:
+        abort(404)
+    boards = BOARD_PAGES
+    column_titles = dict(SOLUTION_COLUMNS)
+
+    # pages are keyed on the last rank shown, so a page costs the same no
+    # matter how deep into the leaderboard it is
+    after = request.args.get('after', 0, type=int)
+    solution_ranks = SolutionRank.page(board.leaderboard_id, level.level_id, reactors, after,
+                                       LEADERBOARD_PAGE_SIZE + 1).all()
+
+    next_after = None
+    if len(solution_ranks) > LEADERBOARD_PAGE_SIZE:
+        solution_ranks = solution_ranks[:LEADERBOARD_PAGE_SIZE]
+        next_after = solution_ranks[-1].rank
+
+    # the registry can be a few seconds behind the table, and the page is cached
+    # until the level's ranks change again, so its reactor counts are read
+    # fresh rather than risk caching stale links
+    level = level._replace(reactor_options=db.session.query(Level.reactor_options)
+                                             .filter(Level.level_id == level.level_id)
+                                             .scalar())
+    reactor_options = [option for option in level.reactor_option_list if option != reactors]
+
+    return render_template('leaderboard.html', type=board.slug, **locals())
+
+
+# request timings and query counts for Prometheus, only shown to the
+# addresses in METRICS_ADDRESSES
+@app.route('/metrics')
+def metrics_page():
+    if request.remote_addr not in app.config.get('METRICS_ADDRESSES', ['127.0.0.1']):
+        abort(404)
+    return Response(metrics.render(password_hasher.metrics()), mimetype='text/plain; version=0.0.4')
 
 
 @app.errorhandler(404)
@@ -449,6 +446,10 @@ def page_not_found(error):
     return render_template('404.html'), 404
 
 
+from api import api
+app.register_module(api)
+
+
 if __name__ == '__main__':
     app.debug = True
     app.run()
@@ -0,0 +1,28 @@
+"""Checks how reactor members are drawn.
+
+    python -m unittest test_members
+"""
+import unittest
+
+# switches to an in-memory database before models connects
+import bench_suite
+from models import UNKNOWN_SPRITE_CLASS, Member
+
+
+def member(type, layer=16, arrow_dir=0):
+    return Member(None, type, arrow_dir, 0, layer, 0, 0, 0, 0)
+
+
+class SpriteClassTest(unittest.TestCase):
+
+    def test_known_type(self):
+        self.assertEqual(member('feature-bonder').sprite_class, 'sprite-feature-bonder')
+
+    def test_unknown_type(self):
+        unknown = member('instr-from-a-newer-game')
+        self.assertEqual(unknown.image_name, None)
+        self.assertEqual(unknown.sprite_class, UNKNOWN_SPRITE_CLASS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""Checks that migrate.py --create gives a database the rows that the
+migrations add, against the in-memory database bench_suite.py sets up.
+
+    python -m unittest test_migrate
+"""
+import unittest
+
+import bench_suite
+from migrate import create
+from models import PARETO_LEADERBOARD, Leaderboard, Version, db
+from spacechem import app
+
+
+class CreateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        bench_suite.check_database()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.execute('DROP TABLE schema_version')
+        self.context.pop()
+
+    def test_data_rows(self):
+        create()
+        self.assertEqual(Leaderboard.query.get(PARETO_LEADERBOARD).slug, 'pareto')
+        names = set(name for (name,) in db.session.query(Version.name))
+        self.assertTrue(set(['ids:solutions', 'ids:components']) <= names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""Checks that the leaderboard, user and solution pages run no more
+statements for a large save than for a small one, against the in-memory
+database bench_suite.py sets up.
+
+    python -m unittest test_query_budgets
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from bench_suite import SAVE_LEVELS, SAVE_MEMBERS, SAVE_PIPES, SAVE_REACTORS, add_levels, add_users, setup_database
+from cache import LRUCache
+from models import SaveFile, Solution, SolutionRender, User, db, level_registry
+from savegen import level_names, write_save
+from spacechem import app, metrics, page_cache, render_cache
+
+# users uploading the large save, so its leaderboards have several rows
+LARGE_UPLOADERS = 5
+
+
+class QueryBudgetTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.context = app.test_request_context()
+        cls.context.push()
+        cls.upload_dir = tempfile.mkdtemp()
+        setup_database(cls.upload_dir)
+        add_levels(['bench-budget'])
+
+        write_save(os.path.join(cls.upload_dir, 'small.user'), ['bench-budget'], 1, SAVE_MEMBERS, SAVE_PIPES)
+        write_save(os.path.join(cls.upload_dir, 'large.user'), level_names(SAVE_LEVELS),
+                   SAVE_REACTORS, SAVE_MEMBERS, SAVE_PIPES)
+        cls.small_user_id, = add_users(1)
+        cls.upload(cls.small_user_id, 'small.user')
+        cls.large_user_ids = add_users(LARGE_UPLOADERS)
+        for user_id in cls.large_user_ids:
+            cls.upload(user_id, 'large.user')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.context.pop()
+        shutil.rmtree(cls.upload_dir)
+
+    @classmethod
+    def upload(cls, user_id, filename):
+        savefile = SaveFile(user_id)
+        db.session.add(savefile)
+        db.session.commit()
+        savefile.process(filename)
+
+    def get(self, url, budget=None):
+        """Returns how many statements a first, uncached view of url ran,
+        failing if that is more than budget."""
+        page_cache.backend = LRUCache(100)
+        render_cache.items.clear()
+        db.session.execute(SolutionRender.__table__.delete())
+        db.session.commit()
+        level_registry.reload()
+
+        with metrics.query_budget(budget if budget is not None else float('inf')) as counter:
+            response = app.test_client().get(url)
+        self.assertEqual(response.status_code, 200)
+        return counter.count
+
+    def username(self, user_id):
+        return User.query.get(user_id).username
+
+    def solution_url(self, solution):
+        return '/solution/{0}/{1}'.format(solution.level.slug, solution.solution_id)
+
+    def test_leaderboard(self):
+        budget = self.get('/leaderboards/bench-budget/cycles')
+        self.get('/leaderboards/bench-level-1/cycles', budget)
+        self.get('/leaderboards/bench-level-1/pareto', budget)
+
+    def test_user_page(self):
+        budget = self.get('/user/' + self.username(self.small_user_id))
+        self.get('/user/' + self.username(self.large_user_ids[0]), budget)
+
+    def test_solution_page(self):
+        small = Solution.query.filter_by(user_id=self.small_user_id).one()
+        large = (Solution.query
+                 .filter_by(user_id=self.large_user_ids[0])
+                 .order_by(Solution.reactor_count.desc(), Solution.solution_id)
+                 .first())
+        self.assertTrue(large.reactor_count > small.reactor_count)
+        small_url, large_url = self.solution_url(small), self.solution_url(large)
+
+        budget = self.get(small_url)
+        self.get(large_url, budget)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Checks the Pareto frontier structures in skyline.py against a brute force
+frontier, the way SolutionRank keeps them up to date.
+
+    python -m unittest test_skyline
+"""
+import itertools
+import random
+import unittest
+
+from skyline import Staircase, frontier, hidden_box, staircases
+
+
+def brute_frontier(keys):
+    """The keys that no other key is at least as good as on cycles, symbols
+    and reactors, ties going to the lower key."""
+    return sorted(key for key in keys
+                  if not any(other < key and all(other[i] <= key[i] for i in range(3)) for other in keys))
+
+
+def bucket(key):
+    return key[2]
+
+
+class SkylineTest(unittest.TestCase):
+
+    def random_keys(self, rng, count, ids):
+        # small ranges, so that equal costs and ties are common
+        return [(rng.randint(1, 12), rng.randint(1, 12), rng.randint(0, 3), rng.randint(0, 2), next(ids))
+                for i in range(count)]
+
+    def test_frontier(self):
+        rng = random.Random(0)
+        ids = itertools.count()
+        for trial in range(200):
+            keys = self.random_keys(rng, rng.randint(0, 40), ids)
+            self.assertEqual(frontier(staircases(keys, bucket)), brute_frontier(keys))
+
+    def test_insert_and_remove(self):
+        """Inserts and removes keys one at a time as insert_pareto and
+        remove_pareto do, refilling from the keys in hidden_box(), and
+        compares the result with the staircases built from scratch."""
+        rng = random.Random(1)
+        ids = itertools.count()
+        for trial in range(50):
+            present = []
+            found = {}
+            for step in range(150):
+                if present and rng.random() < 0.4:
+                    key = present.pop(rng.randrange(len(present)))
+                    staircase = found.get(bucket(key))
+                    if staircase is None or key not in staircase:
+                        continue
+                    first_min, first_max, second_min, second_max = hidden_box(key, *staircase.remove(key))
+                    staircase.refill(other for other in present
+                                     if bucket(other) == bucket(key) and
+                                     first_min <= other[0] and (first_max is None or other[0] <= first_max) and
+                                     second_min <= other[1] and (second_max is None or other[1] <= second_max))
+                    if not staircase:
+                        del found[bucket(key)]
+                else:
+                    key, = self.random_keys(rng, 1, ids)
+                    present.append(key)
+                    found.setdefault(bucket(key), Staircase()).insert(key)
+
+                rebuilt = staircases(present, bucket)
+                self.assertEqual(sorted(found), sorted(rebuilt))
+                for reactors, staircase in found.items():
+                    self.assertEqual(staircase.keys, rebuilt[reactors].keys)
+                self.assertEqual(frontier(found), brute_frontier(present))
+
+
+if __name__ == '__main__':
+    unittest.main()
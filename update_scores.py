@@ -1,45 +1,189 @@
+"""Fetches the official solution histograms for every level, and stores the
+ones that have changed since the last fetch.
+
+    python update_scores.py [--fixture FILE]
+
+Levels that appear in the feed for the first time (new ResearchNet levels)
+are added along the way. Everything is written in a single transaction.
+"""
+from datetime import date
 import json
+from optparse import OptionParser
 import re
 import urllib2
 
-from models import Level, OfficialScores, db
-
-
-level_ids = dict()
-levels = Level.query.all()
-for level in levels:
-    level_ids[level.internal_name] = level.level_id
-
-site = urllib2.urlopen('http://nebula.zachtronicsindustries.com/spacechem/score')
-scores = site.read()
-deserialized = json.loads(scores)
-
-for level in deserialized:
-    # if a new level has been added, need to insert it first
-    if level not in level_ids:
-        new_level = Level()
-        new_level.internal_name = level
-        new_level.slug = level
-        researchnet_pattern = re.compile(r'^published\-(\d+\-\d+)$')
-        if researchnet_pattern.search(level):
-            new_level.number = researchnet_pattern.search(level).groups()[0]
-            new_level.name = 'ResearchNet Published '+new_level.number
-            new_level.order1 = new_level.number.split('-')[0]
-            new_level.order2 = new_level.number.split('-')[1]
-            new_level.category = 'researchnet'
-        else:
-            new_level.number = 'X-X'
-            new_level.name = 'Unknown Name'
-        db.session.add(new_level)
-        db.session.commit()
-        level_ids[level] = new_level.level_id
-
-    level_id = level_ids[level]
-    scores = OfficialScores()
-    scores.level_id = level_ids[level]
-    scores.reactor_counts = deserialized[level]['ReactorCounts']
-    scores.symbol_counts = deserialized[level]['SymbolCounts']
-    scores.cycle_counts = deserialized[level]['CycleCounts']
-    db.session.add(scores)
-
-db.session.commit()
+from sqlalchemy import and_, func
+
+from functions import histogram_hash, parse_histogram
+from models import Level, OfficialScores, Version, bulk_insert, db, reserve_ids
+from spacechem import page_cache
+
+
+SCORES_URL = 'http://nebula.zachtronicsindustries.com/spacechem/score'
+FEED_CHUNK_SIZE = 16 * 1024
+
+RESEARCHNET_PATTERN = re.compile(r'^published\-(\d+\-\d+)$')
+
+# the punctuation allowed in each state of reading the feed, and the state
+# each leads to; the other states expect a key or value
+FEED_PUNCTUATION = {'start': {'{': 'first key'},
+                    'first key': {'}': 'end'},
+                    'colon': {':': 'value'},
+                    'after value': {',': 'key', '}': 'end'}}
+
+
+def read_feed(feed, chunk_size=FEED_CHUNK_SIZE):
+    """Yields (level_name, counts) pairs from the score feed, a JSON object
+    keyed by level name, decoding a level at a time as the feed is read
+    rather than loading all of it first."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    state = 'start'
+    while state != 'end':
+        buffer = buffer.lstrip()
+        punctuation = FEED_PUNCTUATION.get(state, {})
+        if buffer and buffer[0] in punctuation:
+            state = punctuation[buffer[0]]
+            buffer = buffer[1:]
+            continue
+
+        if buffer and state in ('first key', 'key', 'value'):
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except ValueError:
+                # most likely cut off at the end of the buffer
+                pass
+            else:
+                buffer = buffer[end:]
+                if state == 'value':
+                    yield level_name, item
+                    state = 'after value'
+                else:
+                    level_name = item
+                    state = 'colon'
+                continue
+
+        chunk = feed.read(chunk_size)
+        if not chunk:
+            if buffer:
+                raise ValueError('Unexpected {0!r} in score feed'.format(buffer[:20]))
+            raise ValueError('Score feed ended early')
+        buffer += chunk
+
+
+def new_level_row(level_id, internal_name):
+    row = {'level_id': level_id,
+           'internal_name': internal_name,
+           'slug': internal_name,
+           'number': 'X-X',
+           'name': 'Unknown Name',
+           'order1': None,
+           'order2': None,
+           'category': None,
+           'outside_view': False,
+           'reactor_options': ''}
+    match = RESEARCHNET_PATTERN.search(internal_name)
+    if match:
+        row['number'] = match.group(1)
+        row['name'] = 'ResearchNet Published ' + row['number']
+        row['order1'], row['order2'] = [int(part) for part in row['number'].split('-')]
+        row['category'] = 'researchnet'
+    return row
+
+
+def latest_hashes():
+    """Returns {level_id: histogram_hash} for each level's last fetch. Scores
+    stored before hashes were kept have a hash of None."""
+    latest = (db.session.query(OfficialScores.level_id,
+                               func.max(OfficialScores.fetch_date).label('fetch_date'))
+              .group_by(OfficialScores.level_id)
+              .subquery())
+    rows = (db.session.query(OfficialScores.level_id, OfficialScores.histogram_hash)
+            .join((latest, and_(OfficialScores.level_id == latest.c.level_id,
+                                OfficialScores.fetch_date == latest.c.fetch_date))))
+    return dict(rows)
+
+
+def update_scores(feed):
+    """Stores the changed histograms from feed, returning the (slugs of
+    levels with new scores, number of levels added)."""
+    levels = dict((level.internal_name, (level.level_id, level.slug))
+                  for level in db.session.query(Level.internal_name, Level.level_id, Level.slug))
+    hashes = latest_hashes()
+    today = date.today()
+
+    new_levels = []
+    new_scores = []
+    changed = []
+    for internal_name, counts in read_feed(feed):
+        histograms = [parse_histogram(counts[name]) for name in ('ReactorCounts', 'SymbolCounts', 'CycleCounts')]
+
+        if internal_name not in levels:
+            new_levels.append(internal_name)
+            levels[internal_name] = (None, internal_name)
+        elif hashes.get(levels[internal_name][0]) == histogram_hash(*histograms):
+            continue
+
+        new_scores.append((internal_name, histograms))
+        changed.append(levels[internal_name][1])
+
+    level_ids = reserve_ids(Level.__table__, len(new_levels))
+    bulk_insert(Level.__table__, [new_level_row(level_id, internal_name)
+                                  for level_id, internal_name in zip(level_ids, new_levels)])
+    for level_id, internal_name in zip(level_ids, new_levels):
+        levels[internal_name] = (level_id, internal_name)
+    if new_levels:
+        Version.bump('levels')
+
+    # scores are stored as changes from the previous fetch where possible
+    # a second run on the same day replaces that day's scores
+    previous = OfficialScores.latest([levels[internal_name][0] for internal_name, histograms in new_scores],
+                                     today)
+    columns = [column.name for column in OfficialScores.__table__.columns]
+    rows = []
+    for internal_name, histograms in new_scores:
+        scores = OfficialScores()
+        scores.level_id = levels[internal_name][0]
+        scores.fetch_date = today
+        previous_scores, previous_histograms, fetches = previous.get(scores.level_id, (None, None, 0))
+        scores.set_histograms(*histograms, previous=previous_histograms, fetches_since_keyframe=fetches)
+        rows.append(dict((name, getattr(scores, name)) for name in columns))
+    if rows:
+        (OfficialScores.query
+         .filter(and_(OfficialScores.fetch_date == today,
+                      OfficialScores.level_id.in_([row['level_id'] for row in rows])))
+         .delete(synchronize_session=False))
+        db.session.execute(OfficialScores.__table__.insert(), rows)
+        OfficialScores.clear_old_charts([row['level_id'] for row in rows], today)
+    for slug in changed:
+        Version.bump('level:' + slug)
+
+    db.session.commit()
+    return changed, len(new_levels)
+
+
+def main():
+    parser = OptionParser(usage='%prog [--fixture FILE]')
+    parser.add_option('--fixture', metavar='FILE',
+                      help='read the scores from a saved copy of the feed instead of fetching them')
+    options, args = parser.parse_args()
+
+    if options.fixture:
+        feed = open(options.fixture, 'rb')
+    else:
+        feed = urllib2.urlopen(SCORES_URL)
+    try:
+        changed, added = update_scores(feed)
+    finally:
+        feed.close()
+
+    # the stats pages are cached, and new levels show up on the lists
+    for slug in changed:
+        page_cache.bump('level:' + slug)
+    if added:
+        page_cache.bump('levels')
+    print('Stored new scores for {0} levels, added {1} levels'.format(len(changed), added))
+
+
+if __name__ == '__main__':
+    main()
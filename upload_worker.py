@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+from sqlite3 import DatabaseError
+import time
+
+from archives import BadArchive, MAX_SAVE_SIZE, SaveTooLarge
+from forms import savefiles
+from models import SaveFile, db
+from spacechem import app, upload_queue
+
+
+# seconds to wait before checking an empty queue again
+POLL_INTERVAL = 1
+
+
+def discard(savefile, filename):
+    db.session.delete(savefile)
+    db.session.commit()
+    os.remove(savefiles.path(filename))
+
+
+def process_job(job):
+    savefile = SaveFile.query.filter_by(file_id=job['file_id']).one()
+    filename = job['filename']
+
+    def progress(**counts):
+        upload_queue.progress(job['job_id'], **counts)
+
+    try:
+        results = savefile.process(filename, job['approve_all'], progress,
+                                   app.config.get('MAX_SAVE_SIZE', MAX_SAVE_SIZE))
+    except SaveTooLarge:
+        db.session.rollback()
+        discard(savefile, filename)
+        upload_queue.fail(job['job_id'],
+                          'That save file is too large. Please ensure that you are '
+                          'uploading the correct file.')
+        return
+    except BadArchive:
+        db.session.rollback()
+        discard(savefile, filename)
+        upload_queue.fail(job['job_id'],
+                          'Invalid compressed SpaceChem save file. Please ensure that you '
+                          'are uploading the correct file, and that it is a gzipped save '
+                          'file or a zip file containing only a single save file.')
+        return
+    except DatabaseError:
+        db.session.rollback()
+        discard(savefile, filename)
+        upload_queue.fail(job['job_id'],
+                          'Invalid SpaceChem save file. Please ensure that you are '
+                          'uploading the correct file.')
+        return
+    except Exception:
+        db.session.rollback()
+        upload_queue.fail(job['job_id'], 'Processing the save file failed, please try again later.')
+        raise
+
+    upload_queue.finish(job['job_id'], results[0], results[1])
+
+
+def work():
+    # database connections can't be shared with the parent process
+    db.engine.dispose()
+
+    while True:
+        job = upload_queue.claim()
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        try:
+            process_job(job)
+        except Exception:
+            app.logger.exception('Processing upload job {0} failed'.format(job['job_id']))
+        finally:
+            db.session.remove()
+
+
+if __name__ == '__main__':
+    upload_queue.requeue_interrupted()
+
+    workers = [multiprocessing.Process(target=work)
+               for i in range(app.config.get('UPLOAD_WORKERS', 2))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -0,0 +1,118 @@
+import sqlite3
+import time
+
+
+class UploadQueue(object):
+    """A durable queue of uploaded save files waiting to be processed.
+
+    Jobs are kept in a small SQLite database, so they survive restarts and
+    can be shared between the web processes and the upload workers. Each job
+    also records its progress, for the upload status page.
+    """
+
+    COUNTERS = ('levels_parsed', 'solutions_inserted', 'ranks_refreshed')
+
+    def __init__(self, path):
+        self.path = path
+        conn = self.connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                     "job_id INTEGER PRIMARY KEY, "
+                     "file_id INTEGER, "
+                     "user_id INTEGER, "
+                     "filename TEXT, "
+                     "approve_all INTEGER, "
+                     "status TEXT, "
+                     "levels_parsed INTEGER DEFAULT 0, "
+                     "solutions_inserted INTEGER DEFAULT 0, "
+                     "ranks_refreshed INTEGER DEFAULT 0, "
+                     "uploaded INTEGER, "
+                     "skipped INTEGER, "
+                     "error TEXT, "
+                     "queued_time REAL, "
+                     "finished_time REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, job_id)")
+        conn.close()
+
+    def connect(self):
+        # autocommit, transactions that need one are started explicitly
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, file_id, user_id, filename, approve_all):
+        conn = self.connect()
+        cursor = conn.execute("INSERT INTO jobs (file_id, user_id, filename, approve_all, status, queued_time) "
+                              "VALUES (?, ?, ?, ?, 'queued', ?)",
+                              (file_id, user_id, filename, int(bool(approve_all)), time.time()))
+        conn.close()
+        return cursor.lastrowid
+
+    def claim(self):
+        """Marks the oldest queued job as processing and returns it, or None
+        if the queue is empty."""
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            job = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY job_id LIMIT 1").fetchone()
+            if job:
+                conn.execute("UPDATE jobs SET status = 'processing' WHERE job_id = ?", (job['job_id'],))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        if job:
+            job = dict(job)
+            job['status'] = 'processing'
+        return job
+
+    def requeue_interrupted(self):
+        """Puts jobs left half-processed by a stopped worker back in the queue."""
+        conn = self.connect()
+        conn.execute("UPDATE jobs SET status = 'queued', levels_parsed = 0, solutions_inserted = 0, "
+                     "ranks_refreshed = 0 WHERE status = 'processing'")
+        conn.close()
+
+    def progress(self, job_id, **counts):
+        assignments = ', '.join('{0} = ?'.format(name) for name in self.COUNTERS if name in counts)
+        values = [counts[name] for name in self.COUNTERS if name in counts]
+        conn = self.connect()
+        conn.execute("UPDATE jobs SET "+assignments+" WHERE job_id = ?", values + [job_id])
+        conn.close()
+
+    def finish(self, job_id, uploaded, skipped):
+        conn = self.connect()
+        conn.execute("UPDATE jobs SET status = 'done', uploaded = ?, skipped = ?, finished_time = ? "
+                     "WHERE job_id = ?",
+                     (uploaded, skipped, time.time(), job_id))
+        conn.close()
+
+    def fail(self, job_id, error):
+        conn = self.connect()
+        conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_time = ? WHERE job_id = ?",
+                     (error, time.time(), job_id))
+        conn.close()
+
+    def get(self, job_id):
+        conn = self.connect()
+        job = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        conn.close()
+        if job:
+            return dict(job)
+        return None
+
+    def pending_for_user(self, user_id):
+        """Returns the user's job that is still queued or processing, if any."""
+        conn = self.connect()
+        job = conn.execute("SELECT * FROM jobs WHERE user_id = ? AND status IN ('queued', 'processing') "
+                           "ORDER BY job_id LIMIT 1",
+                           (user_id,)).fetchone()
+        conn.close()
+        if job:
+            return dict(job)
+        return None
+
+    def depth(self):
+        conn = self.connect()
+        count = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        conn.close()
+        return count